@@ -18,6 +18,7 @@ fileConfig(config.config_file_name)
 base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 sys.path.append(base_dir)
 from app.sql_app.database import Base
+from app.sql_app import models  # noqa: F401, registers the tables on Base.metadata
 
 target_metadata = Base.metadata
 
@@ -0,0 +1,98 @@
+"""One-shot management commands: python -m app.cli seed-admin | calibrate-hash"""
+import argparse
+import asyncio
+import getpass
+import statistics
+import sys
+import time
+
+from app.config import get_settings
+from app.services.auth import Auth
+from app.sql_app import crud
+from app.sql_app.database import SessionLocal, dispose_db, init_db
+
+
+async def seed_admin(email: str, password: str) -> bool:
+    init_db()
+    try:
+        async with SessionLocal() as db:
+            # skip the bcrypt round on every deploy after the first one
+            if await crud.get_user_by_email(db, email=email):
+                return False
+            hashed_password = Auth.get_password_hash(password)
+            return await crud.create_admin_user(db, email=email, hashed_password=hashed_password) is not None
+    finally:
+        await dispose_db()
+
+
+def verify_seconds(handler, samples: int = 3) -> float:
+    hashed_password = handler.hash("calibration-password")
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.verify("calibration-password", hashed_password)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def calibrate_hash(scheme: str, target: float) -> dict:
+    """Highest cost whose verify time stays within target seconds on this machine."""
+    from passlib.hash import argon2, bcrypt
+
+    settings = get_settings()
+    if scheme == "bcrypt":
+        # every round doubles the time, 4 is the minimum bcrypt accepts
+        best, rounds = 4, 4
+        while rounds <= 20:
+            elapsed = verify_seconds(bcrypt.using(rounds=rounds))
+            print(f"bcrypt rounds={rounds}: {elapsed * 1000:.1f}ms")
+            if elapsed > target:
+                break
+            best, rounds = rounds, rounds + 1
+        return {"BCRYPT_ROUNDS": best}
+    # argon2id: memory and parallelism stay as configured, the time cost grows linearly
+    best, time_cost = 1, 1
+    while time_cost <= 50:
+        handler = argon2.using(type="ID", time_cost=time_cost, memory_cost=settings.argon2_memory_cost,
+                               parallelism=settings.argon2_parallelism)
+        elapsed = verify_seconds(handler)
+        print(f"argon2id time_cost={time_cost} memory_cost={settings.argon2_memory_cost}: {elapsed * 1000:.1f}ms")
+        if elapsed > target:
+            break
+        best, time_cost = time_cost, time_cost + 1
+    return {"ARGON2_TIME_COST": best}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed = commands.add_parser("seed-admin", help="create the admin user if it doesn't exist yet")
+    seed.add_argument("--email", default=None, help="defaults to $ADMIN_EMAIL")
+
+    calibrate = commands.add_parser("calibrate-hash", help="pick the password hash cost for a target verify time")
+    calibrate.add_argument("--scheme", choices=("bcrypt", "argon2"), default=None,
+                           help="defaults to the first of $PASSWORD_SCHEMES")
+    calibrate.add_argument("--target-ms", type=float, default=250, help="verify time per password")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = get_settings()
+    if args.command == "seed-admin":
+        email = args.email or settings.admin_email
+        password = settings.admin_password or getpass.getpass(f"Password for {email}: ")
+        if asyncio.run(seed_admin(email, password)):
+            print(f"Created admin {email}")
+        else:
+            print(f"Admin {email} already exists")
+    elif args.command == "calibrate-hash":
+        scheme = args.scheme or settings.password_schemes[0]
+        # run it on the production hardware, the result only holds for this cpu (and its load)
+        for key, value in calibrate_hash(scheme, target=args.target_ms / 1000).items():
+            print(f"{key}={value}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
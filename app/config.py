@@ -1,6 +1,7 @@
 import sys
 from functools import lru_cache
 from pathlib import Path
+from typing import List, Optional
 
 from pydantic import BaseSettings
 
@@ -18,7 +19,16 @@ class Settings(BaseSettings):
 
     sqlalchemy_database_url: str
     secret_key: str
+    # HS256/HS384/HS512 sign with secret_key, RS256/EdDSA with the PEM key files below
     algorithm: str = "HS256"
+    jwt_private_key_file: Optional[str] = None
+    jwt_public_key_file: Optional[str] = None
+    # trust uid/roles/act claims in access tokens instead of loading the user
+    token_trust_embedded_claims: bool = False
+    token_revocation_sync_interval: float = 30
+    token_revocation_bloom_filter: bool = False
+    # expired rows are deleted from revoked_tokens this often (seconds)
+    token_revocation_prune_interval: float = 3600
     access_token_expire_minutes: int = 30
     registration_token_lifetime: int = 7200
     reset_password_token_lifetime: int = 7200
@@ -29,6 +39,85 @@ class Settings(BaseSettings):
     smtp_server: str
     app_name: str
     mail_sender: str = 'henk@henk.com'
+    mail_queue_size: int = 10000
+    mail_batch_size: int = 50
+    mail_max_retries: int = 5
+    mail_retry_backoff: float = 1.0
+    smtp_idle_timeout: float = 60
+
+    # password hashing, new hashes use the first scheme ("argon2" or "bcrypt"). Hashes made with another
+    # scheme or other parameters are replaced on the next login, `python -m app.cli calibrate-hash` picks the cost
+    password_schemes: List[str] = ["bcrypt"]
+    bcrypt_rounds: int = 12
+    argon2_time_cost: int = 3
+    argon2_memory_cost: int = 65536
+    argon2_parallelism: int = 4
+
+    # password hashing worker pool ("thread" or "process")
+    password_hash_executor: str = "thread"
+    password_hash_workers: int = 4
+    password_hash_max_queue: int = 32
+
+    # bulk imports, workers default to the number of CPUs
+    bulk_chunk_size: int = 1000
+    bulk_hash_workers: Optional[int] = None
+
+    # verified token -> principal cache
+    token_cache_ttl: int = 60
+    token_cache_size: int = 10000
+
+    # (user id, version) -> encoded GET /users/me and /users/{id} body
+    user_response_cache_ttl: int = 3600
+    user_response_cache_size: int = 10000
+
+    # user id -> role names cache
+    role_cache_ttl: int = 300
+    role_cache_size: int = 10000
+
+    # last login / last seen times are buffered per worker and written every activity_flush_interval
+    # seconds, or sooner once activity_max_pending users are waiting
+    activity_flush_interval: float = 10
+    activity_max_pending: int = 50000
+
+    # audit events are queued per worker and inserted in batches. A full queue drops new events ("drop", counted
+    # in the metrics) or makes the request wait up to audit_block_timeout seconds for room first ("block")
+    audit_queue_size: int = 10000
+    audit_batch_size: int = 500
+    audit_overflow_policy: str = "drop"
+    audit_block_timeout: float = 1
+
+    # read replicas for the read-only routes, e.g. ["postgresql://...@replica-1/db"], health checked periodically
+    sqlalchemy_replica_urls: List[str] = []
+    db_replica_check_interval: float = 10
+    db_replica_check_timeout: float = 2
+    # how far the replicas may lag behind, cached users and roles are read from the primary for this long after
+    # they change
+    db_replica_max_lag: float = 5
+
+    # database connection pool, per uvicorn worker and database (ignored for SQLite)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_recycle: int = 1800
+    db_pool_pre_ping: bool = True
+    # connections opened on startup, defaults to db_pool_size, 0 opens none
+    db_pool_warm: Optional[int] = None
+
+    # created by `python -m app.cli seed-admin`, the password is asked for when not set
+    admin_email: str = "admin@admin.com"
+    admin_password: Optional[str] = None
+
+    # prometheus /metrics endpoint, off by default. With a token set the scraper has to send it as a bearer token
+    metrics_enabled: bool = False
+    metrics_token: Optional[str] = None
+
+    # rate limiting, shared between workers when a redis url is set
+    rate_limit_enabled: bool = True
+    rate_limit_redis_url: Optional[str] = None
+    rate_limit_ip_requests: int = 30
+    rate_limit_ip_window: float = 60
+    rate_limit_account_requests: int = 5
+    rate_limit_account_window: float = 300
 
     class Config:
         env_file = "../.env"
@@ -0,0 +1,19 @@
+from fastapi import APIRouter, Depends
+
+from app.services.auth import RoleChecker, get_password_hasher
+from app.sql_app.database import pool_snapshot
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(RoleChecker(['admin']))],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/metrics")
+def read_metrics():
+    return {
+        "password_hasher": get_password_hasher().metrics.snapshot(),
+        "db_pool": pool_snapshot(),
+    }
@@ -0,0 +1,39 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.config import get_settings
+from app.services.activity import get_activity_tracker
+from app.services.audit import get_audit_log
+from app.services.auth import get_password_hasher
+from app.services.mailer import get_mail_queue
+from app.services.metrics import registry
+from app.sql_app.database import pool_snapshot
+
+router = APIRouter(
+    tags=["metrics"],
+    responses={404: {"description": "Not found"}},
+)
+
+registry.register_collector("password_hasher", lambda: get_password_hasher().metrics.snapshot())
+registry.register_collector("db_pool", pool_snapshot)
+registry.register_collector("activity", lambda: get_activity_tracker().snapshot())
+registry.register_collector("audit", lambda: get_audit_log().snapshot())
+registry.register_collector("mail_queue", lambda: get_mail_queue().snapshot())
+
+# filled in by the startup hook of app.main, registered here once however often the app starts
+app_info = {}
+registry.register_collector("app", lambda: app_info)
+
+
+# Prometheus text format. Without METRICS_TOKEN anyone who can reach it can scrape it, keep it off the public network
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics(authorization: Optional[str] = Header(None)):
+    settings = get_settings()
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Not found")
+    if settings.metrics_token and not hmac.compare_digest(authorization or "", f"Bearer {settings.metrics_token}"):
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
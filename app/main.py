@@ -1,15 +1,33 @@
-import uvicorn
+import logging
+import time
+
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.responses import ORJSONResponse
+
+from app.internal import admin, metrics
+from app.routers import audit, auth, users, roles
+from app.sql_app.database import dispose_db, init_db, start_replica_checks, warm_pool
+from app.services import bulk
+from app.services.activity import get_activity_tracker
+from app.services.audit import get_audit_log
+from app.services.auth import get_password_hasher
+from app.config import get_settings
+from app.services.mailer import get_mail_queue
+from app.services.metrics import TimingMiddleware
+from app.services.rate_limit import RateLimitMiddleware
+from app.services.tokens import get_revocation_list
+
+# uvicorn's logger, so the messages end up next to its own
+logger = logging.getLogger("uvicorn.error")
 
-from app.routers import auth, users, roles
-from app.sql_app import crud, schemas
-from app.sql_app.database import get_db
-from app.sql_app.models import User
-from app.services.auth import Auth
+app = FastAPI(default_response_class=ORJSONResponse)
 
-app = FastAPI()
+# added before CORS, so CORS wraps it and the 429 responses carry its headers
+app.add_middleware(
+    RateLimitMiddleware,
+    paths=[("POST", "/auth/token"), ("POST", "/auth/forgot_password"), ("POST", "/users/")],
+)
 
 # CORS Orgigns allwed
 origins = [
@@ -25,20 +43,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# outermost, so the timings include the other middlewares
+app.add_middleware(TimingMiddleware)
+
 # Add routers
 app.include_router(users.router)
 app.include_router(auth.router)
 app.include_router(roles.router)
+app.include_router(audit.router)
+app.include_router(admin.router)
+app.include_router(metrics.router)
 
 
 @app.on_event("startup")
 async def startup_event():
-    db = next(get_db())
-    if crud.get_user_by_email(db=db, email="admin@admin.com"):
-        return None
-    crud.create_admin_user(db, email="admin@admin.com", hashed_password=Auth.get_password_hash(password="admin"))
-    user = crud.get_user_by_email(db, email="admin@admin.com")
-    crud.create_user_role(db, role=schemas.RoleCreate(owner_id=user.id, role="admin"))
+    # per worker: pools and background tasks must not be shared across processes. The admin
+    # is seeded once per deployment with `python -m app.cli seed-admin`, not here
+    started = time.perf_counter()
+    settings = get_settings()
+    init_db()
+    await warm_pool(settings.db_pool_size if settings.db_pool_warm is None else settings.db_pool_warm)
+    await start_replica_checks()
+    get_mail_queue().start()
+    await get_revocation_list().start()
+    get_activity_tracker().start()
+    get_audit_log().start()
+    app.state.startup_seconds = time.perf_counter() - started
+    metrics.app_info["startup_seconds"] = app.state.startup_seconds
+    logger.info("Worker ready in %.3fs", app.state.startup_seconds)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    get_revocation_list().stop()
+    await get_mail_queue().stop()
+    # both write what is still buffered, so before the engine is disposed
+    await get_audit_log().stop()
+    await get_activity_tracker().stop()
+    get_password_hasher().shutdown()
+    bulk.shutdown_hash_pool()
+    await dispose_db()
 
 
 
@@ -46,4 +90,6 @@ async def startup_event():
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    from app import server
+
+    server.main()
@@ -0,0 +1,31 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.auth import RoleChecker
+from app.services.user_utils import MAX_PAGE_SIZE, decode_cursor, paginate
+from app.sql_app import crud, schemas
+from app.sql_app.database import get_read_db
+
+router = APIRouter(
+    prefix="/audit",
+    tags=["audit"],
+    dependencies=[Depends(RoleChecker(['admin']))],
+    responses={404: {"description": "Not found"}},
+)
+
+# Newest first, pass next_cursor to get the older events
+@router.get("/", response_model=schemas.AuditEventPage)
+async def read_audit_events(cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+                            action: Optional[str] = None, user_id: Optional[int] = None,
+                            db: AsyncSession = Depends(get_read_db)):
+    before = decode_cursor(cursor, datetime.fromisoformat, int) if cursor else None
+    events = await crud.get_audit_events(db, before=before, limit=limit + 1, action=action, subject_id=user_id)
+    events, next_cursor = paginate(events, limit, key=lambda event: (event.created_at.isoformat(), event.id))
+    return ORJSONResponse({
+        "events": [schemas.AuditEvent.from_orm(event).dict() for event in events],
+        "next_cursor": next_cursor,
+    })
@@ -1,15 +1,22 @@
-from datetime import timedelta
+import asyncio
+import uuid
+from datetime import datetime, timedelta
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
-from jose import jwt
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import config
 from app.config import get_settings
-from app.services.auth import Auth
+from app.services.activity import get_activity_tracker
+from app.services.audit import client_ip, get_audit_log
+from app.services.auth import Auth, get_current_user, get_password_hasher, get_principal_cache, invalidate_user, \
+    oauth2_scheme
+from app.services.rate_limit import RateLimit
+from app.services.roles import get_role_names
+from app.services.tokens import TokenError, get_revocation_list, get_token_service
 from app.services.mailer import Mailer
-from app.services.user_utils import get_user_response
+from app.services.user_utils import user_json_response
 from app.sql_app import crud
 from app.sql_app import schemas
 from app.sql_app.database import get_db
@@ -22,81 +29,122 @@ router = APIRouter(
 )
 
 
-@router.post("/token", response_model=Token)
-async def login_for_access_token(settings: config.Settings = Depends(get_settings), db: Session = Depends(get_db),
-                                 form_data: OAuth2PasswordRequestForm = Depends()):
-    user = Auth.authenticate_user(db=db, email=form_data.username, password=form_data.password)
+@router.post("/token", response_model=Token, dependencies=[Depends(RateLimit.per_account("login"))])
+async def login_for_access_token(request: Request, background_tasks: BackgroundTasks,
+                                 settings: config.Settings = Depends(get_settings),
+                                 db: AsyncSession = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await Auth.authenticate_user(db=db, email=form_data.username, password=form_data.password)
     if not user:
+        await get_audit_log().record("auth.login_failed", email=form_data.username, ip=client_ip(request))
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # hash made with an old scheme or cost, replace it once the response is out
+    if Auth.needs_rehash(user.hashed_password):
+        background_tasks.add_task(Auth.rehash_password, user.id, form_data.password, user.hashed_password)
+    get_activity_tracker().login(user.id)
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
+    # uid/roles/act let services verify the token without a user lookup, jti allows revoking it
+    role_names = await get_role_names(db, user_id=user.id)
     access_token = Auth.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires, settings=settings
+        data={"sub": user.email, "uid": user.id, "roles": sorted(role_names), "act": user.is_active,
+              "jti": uuid.uuid4().hex},
+        expires_delta=access_token_expires, settings=settings
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+@router.post("/logout")
+async def logout(token: str = Depends(oauth2_scheme), current_user: schemas.User = Depends(get_current_user),
+                 db: AsyncSession = Depends(get_db)):
+    try:
+        payload = get_token_service().decode(token)
+    except TokenError:
+        # expired since get_current_user accepted it, nothing left to revoke
+        raise HTTPException(status_code=401, detail="Could not validate credentials",
+                            headers={"WWW-Authenticate": "Bearer"})
+    if payload.get("jti") is None:
+        raise HTTPException(status_code=400, detail="Token can't be revoked")
+    await crud.revoke_token(db, jti=payload["jti"], expires_at=datetime.utcfromtimestamp(payload["exp"]))
+    get_revocation_list().add(payload["jti"])
+    principal_cache = get_principal_cache()
+    principal_cache.pop(principal_cache.key(token))
+    return True
+
+
+# public keys for services verifying RS256/EdDSA tokens themselves
+@router.get("/jwks")
+async def read_jwks():
+    return get_token_service().jwks()
+
+
 @router.get("/activate_email/{token}", response_model=schemas.User)
-async def verify_email(token: str, settings: config.Settings = Depends(get_settings), db: Session = Depends(get_db)):
+async def verify_email(request: Request, token: str, settings: config.Settings = Depends(get_settings),
+                       db: AsyncSession = Depends(get_db)):
     invalid_token_error = HTTPException(status_code=400, detail="Invalid token")
     # Check if token expiration date is reached
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=settings.algorithm)
-    except jwt.JWTError:
+        payload = get_token_service().decode(token)
+    except TokenError:
         raise HTTPException(status_code=403, detail="Token has expired")
     # Check if scope of the token is valid
-    if payload['scope'] != 'registration':
+    if payload.get('scope') != 'registration':
         raise invalid_token_error
-    user = crud.get_user_by_email(db=db, email=payload['sub'])
+    user = await crud.get_user_by_email(db=db, email=payload['sub'], with_roles=True)
     # Check if token belongs to user and not already been used
     if not user or user.confirmation is None or user.confirmation.hex != payload['jti']:
         raise invalid_token_error
     # Check if email is already activated
     if user.is_active:
         raise HTTPException(status_code=403, detail="User already activated")
-    user.confirmation = None
-    user.is_active = True
-    db.commit()
-    return get_user_response(db=db, user_id=user.id)
+    await crud.activate_user(db, user)
+    invalidate_user(user.id)
+    await get_audit_log().record("user.verify_email", subject_id=user.id, email=user.email, ip=client_ip(request))
+    return user_json_response(user)
 
-@router.post("/forgot_password")
-async def forgot_password(user: schemas.UserBase, db: Session = Depends(get_db)):
-    user = crud.get_user_by_email(db=db, email=user.email)
+@router.post("/forgot_password", dependencies=[Depends(RateLimit.per_account("forgot_password"))])
+async def forgot_password(request: Request, user: schemas.UserBase, db: AsyncSession = Depends(get_db)):
+    email = user.email
+    user = await crud.get_user_by_email(db=db, email=email)
     if not user:
+        # probing for accounts shows up in the trail as well
+        await get_audit_log().record("user.forgot_password", email=email, ip=client_ip(request), found=False)
         raise HTTPException(status_code=400, detail="Email address does not exist")
     reset = Auth.create_password_reset_token(user_email=user.email)
     try:
         Mailer.send_password_reset_message(token=reset["token"], mail_to=user.email)
-    except ConnectionRefusedError:
+    except asyncio.QueueFull:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Email couldn't be send. Please try again."
         )
+    await get_audit_log().record("user.forgot_password", subject_id=user.id, email=user.email, ip=client_ip(request),
+                                 found=True)
     return True
 
 # reset password
 @router.post("/reset_password/{token}")
-async def reset_password(data:schemas.ResetPassword, token: str, settings: config.Settings = Depends(get_settings), db: Session = Depends(get_db)):
+async def reset_password(request: Request, data:schemas.ResetPassword, token: str, settings: config.Settings = Depends(get_settings), db: AsyncSession = Depends(get_db)):
     # decode token and get user
     invalid_token_error = HTTPException(status_code=400, detail="Invalid token")
     try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=settings.algorithm)
-    except jwt.JWTError:
+        payload = get_token_service().decode(token)
+    except TokenError:
         raise HTTPException(status_code=403, detail="Token has expired")
-    if payload['scope'] != 'reset_password':
+    if payload.get('scope') != 'password_reset':
         raise invalid_token_error
     # Look up user from token
-    user = crud.get_user_by_email(db=db, email=payload['sub'])
+    user = await crud.get_user_by_email(db=db, email=payload['sub'], with_roles=True)
     if not user:
         raise invalid_token_error
     # hash the new password and save it
-    hashed_password = Auth.get_password_hash(password=data.password)
-    user.hashed_password = hashed_password
-    db.commit()
-    return get_user_response(db=db, user_id=user.id)
+    hashed_password = await get_password_hasher().hash(password=data.password)
+    await crud.set_password(db, user, hashed_password)
+    invalidate_user(user.id)
+    await get_audit_log().record("user.reset_password", subject_id=user.id, email=user.email, ip=client_ip(request))
+    return user_json_response(user)
 # https://dev.to/paurakhsharma/flask-rest-api-part-5-password-reset-2f2e
 
 # reset password
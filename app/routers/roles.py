@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.services.auth import RoleChecker
+from app.services import bulk
+from app.services.audit import client_ip, get_audit_log
+from app.services.auth import RoleChecker, get_current_user, invalidate_user
 from app.sql_app import crud, schemas
 from app.sql_app.database import get_db
 
@@ -13,5 +16,18 @@ router = APIRouter(
 
 
 @router.post("/", response_model=schemas.Role, dependencies=[Depends(RoleChecker(['admin']))])
-def create_user_role(role: schemas.RoleCreate, db: Session = Depends(get_db)):
-    return crud.create_user_role(db=db, role=role)
+async def create_user_role(request: Request, role: schemas.RoleCreate, db: AsyncSession = Depends(get_db),
+                           current_user: schemas.User = Depends(get_current_user)):
+    db_role = await crud.create_user_role(db=db, role=role)
+    if db_role is None:
+        raise HTTPException(status_code=400, detail="Role already assigned or user not found")
+    invalidate_user(role.owner_id)
+    await get_audit_log().record("role.create", actor_id=current_user.id, subject_id=role.owner_id,
+                                 ip=client_ip(request), role=role.role)
+    return db_role
+
+
+# NDJSON or CSV (owner_id,role), one result line per row is streamed back
+@router.post("/bulk", dependencies=[Depends(RoleChecker(['admin']))])
+async def import_roles(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    return StreamingResponse(bulk.import_roles(db, file), media_type="application/x-ndjson")
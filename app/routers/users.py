@@ -1,16 +1,21 @@
-from typing import List
+import asyncio
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, File, Header, HTTPException, Query, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from app.services.auth import Auth, get_current_user
+from app.services.audit import client_ip, get_audit_log
+from app.services.auth import Auth, get_current_user, get_password_hasher, invalidate_user
+from app.services import bulk
 from app.services.auth import RoleChecker
+from app.services.rate_limit import RateLimit
 from app.services.mailer import Mailer
-from app.services.user_utils import get_user_response, get_all_users_response
+from app.services.user_utils import MAX_PAGE_SIZE, get_all_users_response, export_users, \
+    get_user_conditional_response, principal_conditional_response, user_json_response
 from app.sql_app import crud, schemas
-from app.sql_app.database import get_db
-from app.sql_app.models import User
+from app.sql_app.database import get_db, get_read_db
 
 router = APIRouter(
     prefix="/users",
@@ -18,50 +23,62 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-
-@router.post("/", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
+@router.post("/", response_model=schemas.User, dependencies=[Depends(RateLimit.per_account("register"))])
+async def register(request: Request, user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     confirmation = Auth.create_confirmation_token(user.email)
+    hashed_password = await get_password_hasher().hash(user.password)
+    # the unique index on email is the duplicate check, no SELECT up front. The confirmation is queued
+    # before the commit: when the mail queue is full no account is left behind that can't be confirmed
     try:
-        Mailer.send_confirmation_message(confirmation["token"], user.email)
-    except ConnectionRefusedError:
+        db_user = await crud.create_user_with_roles(
+            db=db, user=user, hashed_password=hashed_password, confirmation=confirmation["jti"], roles=["user"],
+            before_commit=lambda _: Mailer.send_confirmation_message(confirmation["token"], user.email))
+    except asyncio.QueueFull:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Email couldn't be send. Please try again."
         )
-    user = crud.create_user(db=db, user=user, hashed_password=Auth.get_password_hash(user.password),
-                            confirmation=confirmation["jti"])
-    role = schemas.RoleCreate(owner_id=user.id, role="user")
-    crud.create_user_role(db=db, role=role)
-    print(confirmation['token'])
-    return get_user_response(db=db, user_id=user.id)
+    if db_user is None:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    await get_audit_log().record("user.register", subject_id=db_user.id, email=user.email, ip=client_ip(request))
+    return user_json_response(db_user)
+
 
+# NDJSON or CSV (email,password[,is_active]), one result line per row is streamed back
+@router.post("/bulk", dependencies=[Depends(RoleChecker(['admin']))])
+async def import_users(file: UploadFile = File(...), db: AsyncSession = Depends(get_db)):
+    return StreamingResponse(bulk.import_users(db, file), media_type="application/x-ndjson")
 
-@router.get("/", response_model=List[schemas.User], dependencies=[Depends(RoleChecker(['admin']))])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = get_all_users_response(db, skip=skip, limit=limit)
-    return users
+
+@router.get("/", response_model=schemas.UserPage, dependencies=[Depends(RoleChecker(['admin']))])
+async def read_users(cursor: Optional[str] = None, limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+                     email: Optional[str] = None, db: AsyncSession = Depends(get_read_db)):
+    return await get_all_users_response(db, cursor=cursor, limit=limit, email_prefix=email)
+
+
+@router.get("/export", dependencies=[Depends(RoleChecker(['admin']))])
+async def export_user_directory(format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+                                db: AsyncSession = Depends(get_read_db)):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(export_users(db, export_format=format), media_type=media_type,
+                             headers={"Content-Disposition": f"attachment; filename=users.{format}"})
 
 
 @router.get("/me", response_model=schemas.User)
-def read_user(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return get_user_response(db, user_id=current_user.id)
+async def read_user(current_user: schemas.User = Depends(get_current_user), if_none_match: Optional[str] = Header(None)):
+    return principal_conditional_response(current_user, if_none_match=if_none_match)
 
 
 @router.put("/me", response_model=schemas.User)
-def update_me(user: schemas.UserUpdate, current_user: User = Depends(get_current_user),
-              db: Session = Depends(get_db)):
-    updated_user = crud.update_user(db=db, user_id=current_user.id, updated_user=user)
-    return get_user_response(db=db, user_id=updated_user.id)
+async def update_me(request: Request, user: schemas.UserUpdate, current_user: schemas.User = Depends(get_current_user),
+                    db: AsyncSession = Depends(get_db)):
+    updated_user = await crud.update_user(db=db, user_id=current_user.id, updated_user=user)
+    invalidate_user(current_user.id)
+    await get_audit_log().record("user.update", actor_id=current_user.id, subject_id=current_user.id,
+                                 email=current_user.email, ip=client_ip(request), changes=user.dict(exclude_unset=True))
+    return user_json_response(updated_user)
 
 
 @router.get("/{user_id}", response_model=schemas.User, dependencies=[Depends(RoleChecker(['admin']))])
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
-    if db_user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    user = get_user_response(db, user_id=user_id)
-    return user
+async def read_user(user_id: int, db: AsyncSession = Depends(get_read_db), if_none_match: Optional[str] = Header(None)):
+    return await get_user_conditional_response(db, user_id=user_id, if_none_match=if_none_match)
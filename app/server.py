@@ -0,0 +1,108 @@
+"""Production server: python -m app.server --workers 4
+
+Every worker is a separate (spawned) process that imports the app and opens its own
+database pool, caches and background tasks in the startup hook.
+"""
+import argparse
+import asyncio
+import logging
+import os
+
+import uvicorn
+from uvicorn.supervisors import Multiprocess
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def default_workers() -> int:
+    if "WEB_CONCURRENCY" in os.environ:
+        return int(os.environ["WEB_CONCURRENCY"])
+    # cores this process may actually run on, e.g. limited by taskset or a container
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+class Server(uvicorn.Server):
+    """uvicorn server that gives in-flight requests graceful_timeout seconds on shutdown."""
+
+    def __init__(self, config: uvicorn.Config, graceful_timeout: float):
+        super().__init__(config)
+        self.graceful_timeout = graceful_timeout
+
+    async def shutdown(self, sockets=None):
+        # uvicorn waits for open connections forever, abort the stragglers so the
+        # shutdown hooks (mail queue, engine) still run before the process is killed
+        timer = asyncio.get_event_loop().call_later(self.graceful_timeout, self._abort_requests)
+        try:
+            await super().shutdown(sockets=sockets)
+        finally:
+            timer.cancel()
+
+    def _abort_requests(self):
+        logger.warning("Graceful shutdown timed out after %ss, aborting %s connections",
+                       self.graceful_timeout, len(self.server_state.connections))
+        for connection in list(self.server_state.connections):
+            connection.transport.close()
+        for task in list(self.server_state.tasks):
+            task.cancel()
+
+
+class Supervisor(Multiprocess):
+    """Passes SIGTERM/SIGINT on to the workers, uvicorn's supervisor only waits for them to exit."""
+
+    def shutdown(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        super().shutdown()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the API with uvloop and httptools.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="worker processes, defaults to $WEB_CONCURRENCY or the number of usable cores")
+    parser.add_argument("--backlog", type=int, default=2048, help="pending connections queued by the kernel")
+    # longer than the idle timeout of the load balancer in front of us (60s on most)
+    parser.add_argument("--keep-alive", type=int, default=65, help="idle keep-alive timeout in seconds")
+    parser.add_argument("--limit-concurrency", type=int, default=1000,
+                        help="connections per worker before new ones get a 503")
+    parser.add_argument("--max-requests", type=int, default=None, help="restart a worker after this many requests")
+    parser.add_argument("--graceful-timeout", type=float, default=30, help="seconds to drain requests on shutdown")
+    parser.add_argument("--forwarded-allow-ips", default=None, help="proxies trusted for X-Forwarded-* headers")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = uvicorn.Config(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop="uvloop",
+        http="httptools",
+        lifespan="on",
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        limit_concurrency=args.limit_concurrency,
+        limit_max_requests=args.max_requests,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        log_level=args.log_level,
+        access_log=args.access_log,
+    )
+    server = Server(config, graceful_timeout=args.graceful_timeout)
+    if config.workers > 1:
+        # the socket is bound once here and shared, the app itself is only imported in the workers
+        sock = config.bind_socket()
+        Supervisor(config, target=server.run, sockets=[sock]).run()
+    else:
+        server.run()
+
+
+if __name__ == "__main__":
+    main()
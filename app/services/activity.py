@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Optional
+
+from app.config import get_settings
+from app.sql_app import crud
+from app.sql_app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityTracker:
+    """Write-behind buffer for the last login / last seen times of users.
+
+    Requests only set a dict entry, so repeated activity of a user coalesces into
+    one row. A background task writes the buffer every flush_interval seconds, or
+    as soon as max_pending users are waiting. Activity of new users is dropped
+    (and counted) while the buffer is full. stop() flushes what is left, a worker
+    that crashes loses at most one interval of activity.
+    """
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._logins: Dict[int, datetime] = {}
+        self._seen: Dict[int, datetime] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.flushed = 0
+        self.flush_errors = 0
+
+    def login(self, user_id: int):
+        now = datetime.utcnow()
+        self._record(self._logins, user_id, now)
+        self._record(self._seen, user_id, now)
+
+    def seen(self, user_id: int):
+        self._record(self._seen, user_id, datetime.utcnow())
+
+    def _record(self, pending: Dict[int, datetime], user_id: int, at: datetime):
+        if user_id not in pending and len(pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        pending[user_id] = at
+        if len(pending) >= self.max_pending and self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._seen) + len(self._logins)
+
+    def snapshot(self) -> dict:
+        return {"pending": self.pending(), "dropped": self.dropped, "flushed": self.flushed,
+                "flush_errors": self.flush_errors}
+
+    async def flush(self):
+        if not self._logins and not self._seen:
+            return
+        # swap the buffers, requests keep recording into fresh ones during the write
+        logins, seen = self._logins, self._seen
+        self._logins, self._seen = {}, {}
+        try:
+            async with SessionLocal() as db:
+                await crud.update_activity(db, logins=logins, seen=seen)
+        except BaseException:
+            # failed or cancelled: retry with the next flush, times recorded meanwhile are newer
+            self._restore(self._logins, logins)
+            self._restore(self._seen, seen)
+            raise
+        self.flushed += len(logins) + len(seen)
+
+    def _restore(self, pending: Dict[int, datetime], failed: Dict[int, datetime]):
+        for user_id, at in failed.items():
+            if len(pending) >= self.max_pending:
+                self.dropped += 1
+            else:
+                pending.setdefault(user_id, at)
+
+    async def _flush(self):
+        try:
+            await self.flush()
+        except Exception:
+            self.flush_errors += 1
+            logger.exception("Could not write the activity of %d users", self.pending())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self._flush()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._flush()
+
+
+@lru_cache()
+def get_activity_tracker() -> ActivityTracker:
+    settings = get_settings()
+    return ActivityTracker(flush_interval=settings.activity_flush_interval,
+                           max_pending=settings.activity_max_pending)
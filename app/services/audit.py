@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Optional
+
+from fastapi import Request
+
+from app.config import get_settings
+from app.sql_app import crud
+from app.sql_app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop", "block")
+
+
+class AuditLog:
+    """In-process queue of audit events, inserted in batches by a background task.
+
+    Recording an event only puts it on a bounded queue, the request never waits for
+    the insert. When the queue is full the event is dropped, or with the "block"
+    policy the request waits up to block_timeout seconds for room before dropping
+    it. Drops and failed inserts are counted, see snapshot().
+    """
+
+    def __init__(self, maxsize: int, batch_size: int, overflow_policy: str, block_timeout: float):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown audit overflow policy {overflow_policy!r}, use one of {OVERFLOW_POLICIES}")
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # events taken off the queue by the worker and not written yet
+        self._in_flight = 0
+        self.dropped = 0
+        self.written = 0
+        self.write_errors = 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pending = self.qsize() + self._in_flight
+            logger.warning("Audit queue not drained after %ss, dropping %d events", timeout, pending)
+            self.dropped += pending
+        # events recorded from now on are dropped, like before start
+        self._queue = None
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def snapshot(self) -> dict:
+        return {"queued": self.qsize(), "dropped": self.dropped, "written": self.written,
+                "write_errors": self.write_errors}
+
+    async def record(self, action: str, actor_id: Optional[int] = None, subject_id: Optional[int] = None,
+                     email: Optional[str] = None, ip: Optional[str] = None, **detail):
+        event = {"created_at": datetime.utcnow(), "action": action, "actor_id": actor_id, "subject_id": subject_id,
+                 "email": email, "ip": ip, "detail": detail or None}
+        if self._queue is None:
+            # not started, e.g. the app imported by a script
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait(event)
+            return
+        except asyncio.QueueFull:
+            if self.overflow_policy == "drop":
+                self.dropped += 1
+                return
+        try:
+            await asyncio.wait_for(self._queue.put(event), self.block_timeout)
+        except asyncio.TimeoutError:
+            self.dropped += 1
+
+    async def _run(self):
+        # stop() clears self._queue before cancelling the worker
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            self._in_flight = len(batch)
+            try:
+                await self._write(batch)
+            finally:
+                self._in_flight = 0
+                for _ in batch:
+                    queue.task_done()
+
+    async def _write(self, batch: List[dict]):
+        try:
+            async with SessionLocal() as db:
+                await crud.create_audit_events(db, batch)
+        except Exception:
+            self.write_errors += 1
+            logger.exception("Could not write %d audit events", len(batch))
+            return
+        self.written += len(batch)
+
+
+def client_ip(request: Request) -> Optional[str]:
+    # the proxy's address unless the server trusts its X-Forwarded-For (--forwarded-allow-ips)
+    return request.client.host if request.client else None
+
+
+@lru_cache()
+def get_audit_log() -> AuditLog:
+    settings = get_settings()
+    return AuditLog(
+        maxsize=settings.audit_queue_size,
+        batch_size=settings.audit_batch_size,
+        overflow_policy=settings.audit_overflow_policy,
+        block_timeout=settings.audit_block_timeout,
+    )
@@ -1,36 +1,171 @@
+import asyncio
+import hashlib
+import time
 import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional, List
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app import config
 from app.config import get_settings
-from app.sql_app.crud import get_user_by_email
-from app.sql_app.database import get_db
-from app.sql_app.schemas import TokenData, User
+from app.services.activity import get_activity_tracker
+from app.services.cache import TTLCache
+from app.services.metrics import current_timings, password_hash_duration, password_hash_queue_wait
+from app.services.roles import get_role_names, invalidate_roles
+from app.services.tokens import TokenError, get_revocation_list, get_token_service
+from app.services.user_utils import build_user_response
+from app.sql_app.crud import get_user_by_email, update_password_hash
+from app.sql_app.database import SessionLocal, get_read_db, may_read_stale, read_user_from_primary
+from app.sql_app.schemas import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-settings = get_settings()
 
+# shared by hashing and verifying, passlib is only imported once a password is touched
+@lru_cache()
+def get_password_context():
+    from passlib.context import CryptContext
+    settings = get_settings()
+    # every scheme but the first is deprecated, so needs_update() flags those hashes as well
+    return CryptContext(
+        schemes=settings.password_schemes,
+        deprecated="auto",
+        bcrypt__rounds=settings.bcrypt_rounds,
+        argon2__type="ID",
+        argon2__time_cost=settings.argon2_time_cost,
+        argon2__memory_cost=settings.argon2_memory_cost,
+        argon2__parallelism=settings.argon2_parallelism,
+    )
+
+
+# Worker functions, kept at module level so they can be pickled into a process pool.
+# They return their own start/finish times so the caller can split queue wait from hash time.
+def _hash_password(password: str):
+    started = time.monotonic()
+    hashed_password = get_password_context().hash(password)
+    return hashed_password, started, time.monotonic()
+
+
+def _verify_password(plain_password: str, hashed_password: str):
+    started = time.monotonic()
+    valid = get_password_context().verify(plain_password, hashed_password)
+    return valid, started, time.monotonic()
+
+
+class HasherMetrics:
+    def __init__(self):
+        self.completed = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.hash_time_total = 0.0
+        self.hash_time_max = 0.0
+
+    def observe(self, queue_wait: float, hash_time: float):
+        self.completed += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.hash_time_total += hash_time
+        self.hash_time_max = max(self.hash_time_max, hash_time)
+
+    def snapshot(self) -> dict:
+        completed = self.completed or 1
+        return {
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+            "queue_wait_avg_seconds": self.queue_wait_total / completed,
+            "queue_wait_max_seconds": self.queue_wait_max,
+            "hash_time_avg_seconds": self.hash_time_total / completed,
+            "hash_time_max_seconds": self.hash_time_max,
+        }
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded worker pool so it never blocks the event loop.
+
+    At most ``workers + max_queue`` jobs are accepted at once, further calls are
+    rejected straight away with a 503 instead of queueing behind a login storm.
+    """
+
+    def __init__(self, executor: str, workers: int, max_queue: int):
+        self.executor = executor
+        self.workers = workers
+        self.max_queue = max_queue
+        self.metrics = HasherMetrics()
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.executor == "process":
+                from concurrent.futures import ProcessPoolExecutor
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hasher")
+        return self._pool
+
+    async def _run(self, operation: str, func, *args):
+        # only touched from the event loop, so no lock is needed around the counter
+        if self.metrics.in_flight >= self.workers + self.max_queue:
+            self.metrics.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again.",
+                headers={"Retry-After": "1"},
+            )
+        self.metrics.in_flight += 1
+        submitted = time.monotonic()
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(
+                self._get_pool(), func, *args)
+        finally:
+            self.metrics.in_flight -= 1
+        self.metrics.observe(queue_wait=started - submitted, hash_time=finished - started)
+        password_hash_queue_wait.observe(started - submitted)
+        password_hash_duration.observe(finished - started, operation)
+        timings = current_timings()
+        if timings is not None:
+            timings.hash_seconds += finished - started
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", _verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+@lru_cache()
+def get_password_hasher() -> PasswordHasher:
+    settings = get_settings()
+    return PasswordHasher(
+        executor=settings.password_hash_executor,
+        workers=settings.password_hash_workers,
+        max_queue=settings.password_hash_max_queue,
+    )
 
-class Auth:
-    password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-    @classmethod
-    def get_password_hash(cls, password: str) -> str:
-        return cls.password_context.hash(password)
+class Auth:
+    @staticmethod
+    def get_password_hash(password: str) -> str:
+        return get_password_context().hash(password)
 
     @staticmethod
     def verify_password(plain_password, hashed_password):
-        return pwd_context.verify(plain_password, hashed_password)
+        return get_password_context().verify(plain_password, hashed_password)
 
     @staticmethod
     def create_access_token(data: dict, settings: config.Settings,
@@ -41,11 +176,11 @@ class Auth:
         else:
             expire = datetime.utcnow() + timedelta(minutes=15)
         to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
-        return encoded_jwt
+        return get_token_service().encode(to_encode)
 
     @staticmethod
     def create_confirmation_token(user_email: str):
+        settings = get_settings()
         jti = uuid.uuid4()
         claims = {
             "sub": user_email,
@@ -63,6 +198,7 @@ class Auth:
 
     @staticmethod
     def create_password_reset_token(user_email: str):
+        settings = get_settings()
         jti = uuid.uuid4()
         claims = {
             "sub": user_email,
@@ -80,35 +216,127 @@ class Auth:
 
     # Authenticate and return user
     @staticmethod
-    def authenticate_user(email: str, password: str, db: Session):
-        user = get_user_by_email(db=db, email=email)
+    async def authenticate_user(email: str, password: str, db: AsyncSession):
+        user = await get_user_by_email(db=db, email=email)
         if not user:
             return False
-        if not Auth.verify_password(password, user.hashed_password):
+        if not await get_password_hasher().verify(password, user.hashed_password):
             return False
         return user
 
+    @staticmethod
+    def needs_rehash(hashed_password: str) -> bool:
+        return get_password_context().needs_update(hashed_password)
+
+    # Run as a background task after a login, so the extra hash doesn't delay the response
+    @staticmethod
+    async def rehash_password(user_id: int, password: str, old_hash: str):
+        try:
+            hashed_password = await get_password_hasher().hash(password)
+        except HTTPException:
+            # hasher is saturated, the next login tries again
+            return
+        async with SessionLocal() as db:
+            await update_password_hash(db, user_id=user_id, old_hash=old_hash, new_hash=hashed_password)
+
+
+class PrincipalCache(TTLCache):
+    """Verified token -> (user principal, token id), keyed by the token hash.
+
+    Keeps an index of cached tokens per user so every token of a user can be
+    dropped as soon as that user changes.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self._keys_by_user = defaultdict(set)
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def add(self, token: str, principal: User, jti: Optional[str], expires_at: Optional[float] = None):
+        ttl = None if expires_at is None else expires_at - time.time()
+        self.set(self.key(token), (principal, jti), ttl=ttl)
+
+    def lookup(self, token: str):
+        return self.get(self.key(token))
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            keys = list(self._keys_by_user.get(user_id, ()))
+        for key in keys:
+            self.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._keys_by_user.clear()
+
+    def on_set(self, key, value):
+        self._keys_by_user[value[0].id].add(key)
+
+    def on_evict(self, key, value):
+        user_id = value[0].id
+        keys = self._keys_by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user_id]
+
+
+@lru_cache()
+def get_principal_cache() -> PrincipalCache:
+    settings = get_settings()
+    return PrincipalCache(maxsize=settings.token_cache_size, ttl=settings.token_cache_ttl)
+
+
+# call whenever a user or its roles change
+def invalidate_user(user_id: int):
+    read_user_from_primary(user_id)
+    invalidate_roles(user_id)
+    get_principal_cache().invalidate_user(user_id)
+
 
 # get current user
-async def get_current_user(db: Session = Depends(get_db), settings: config.Settings = Depends(get_settings),
+async def get_current_user(db: AsyncSession = Depends(get_read_db), settings: config.Settings = Depends(get_settings),
                            token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        username: str = payload.get("sub")
-        if username is None:
+    principal_cache = get_principal_cache()
+    cached = principal_cache.lookup(token)
+    if cached is not None:
+        principal, jti = cached
+    else:
+        try:
+            payload = get_token_service().decode(token)
+        except TokenError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user_by_email(db, email=token_data.username)
-    if user is None:
+        # registration and password reset tokens can't be used to log in
+        if payload.get("sub") is None or payload.get("scope") is not None:
+            raise credentials_exception
+        jti = payload.get("jti")
+        if settings.token_trust_embedded_claims and "uid" in payload:
+            principal = User.construct(id=payload["uid"], email=payload["sub"], is_active=payload.get("act", False),
+                                       confirmation=None, roles=payload.get("roles", []))
+        else:
+            user = await get_user_by_email(db, email=payload["sub"])
+            if user is not None and may_read_stale(db, user.id):
+                # changed recently, cache what the primary has rather than what the replica has
+                async with SessionLocal() as primary_db:
+                    user = await get_user_by_email(primary_db, email=payload["sub"])
+            if user is None:
+                raise credentials_exception
+            principal = build_user_response(user, role_names=await get_role_names(db, user_id=user.id))
+        principal_cache.add(token, principal, jti=jti, expires_at=payload.get("exp"))
+    if jti is not None and await get_revocation_list().is_revoked(db, jti):
         raise credentials_exception
-    return user
+    # buffered, written by the activity tracker in batches
+    get_activity_tracker().seen(principal.id)
+    return principal
 
 
 # get current active use
@@ -120,11 +348,10 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
 
 class RoleChecker:
     def __init__(self, allowed_roles: List):
-        self.allowed_roles = allowed_roles
+        self.allowed_roles = frozenset(allowed_roles)
 
-    def __call__(self, user: User = Depends(get_current_active_user)):
-        for role in user.roles:
-            if role in self.allowed_roles:
-                return True
-            else:
-                raise HTTPException(status_code=403, detail="Operation not permitted")
+    # roles come with the (cached) principal, checking them costs no query
+    async def __call__(self, user: User = Depends(get_current_active_user)):
+        if self.allowed_roles.isdisjoint(user.roles):
+            raise HTTPException(status_code=403, detail="Operation not permitted")
+        return True
@@ -0,0 +1,189 @@
+import asyncio
+import csv
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Tuple
+
+import orjson
+from fastapi import UploadFile
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.config import get_settings
+from app.services.auth import _hash_password, invalidate_user
+from app.sql_app import crud, schemas
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+_hash_pool = None
+
+
+def _get_hash_pool() -> "ProcessPoolExecutor":
+    # separate from the login hasher so an import can't starve interactive logins
+    global _hash_pool
+    if _hash_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _hash_pool = ProcessPoolExecutor(max_workers=get_settings().bulk_hash_workers)
+    return _hash_pool
+
+
+def shutdown_hash_pool():
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=True)
+        _hash_pool = None
+
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    loop = asyncio.get_running_loop()
+    pool = _get_hash_pool()
+    results = await asyncio.gather(*(loop.run_in_executor(pool, _hash_password, p) for p in passwords))
+    return [hashed_password for hashed_password, _, _ in results]
+
+
+# raw lines, decoded per row by read_rows so a bad byte is reported as that row's error
+def _read_lines(fileobj, count: int) -> List[bytes]:
+    lines = []
+    for _ in range(count):
+        line = fileobj.readline()
+        if not line:
+            break
+        lines.append(line.rstrip(b"\r\n"))
+    return lines
+
+
+async def read_rows(file: UploadFile, chunk_size: int) -> AsyncIterator[List[Tuple[int, object]]]:
+    """Yields chunks of (line number, dict) from an NDJSON or CSV upload.
+
+    Rows that can't be parsed are yielded as (line number, error message).
+    CSV files need a header line, quoted fields can't span lines.
+    """
+    is_csv = file.content_type == "text/csv" or (file.filename or "").lower().endswith(".csv")
+    header = None
+    line_number = 0
+    while True:
+        lines = await run_in_threadpool(_read_lines, file.file, chunk_size)
+        if not lines:
+            return
+        if is_csv and header is None:
+            line_number += 1
+            try:
+                header = next(csv.reader([lines[0].decode("utf-8-sig")]))
+            except (csv.Error, UnicodeDecodeError) as e:
+                # without the column names no row can be read
+                yield [(line_number, f"Malformed header: {e}")]
+                return
+            lines = lines[1:]
+        chunk = []
+        for raw_line in lines:
+            line_number += 1
+            if not raw_line.strip():
+                continue
+            try:
+                line = raw_line.decode("utf-8-sig")
+                if is_csv:
+                    row = dict(zip(header, next(csv.reader([line]))))
+                else:
+                    row = orjson.loads(line)
+                    if not isinstance(row, dict):
+                        raise ValueError("expected a JSON object")
+            except (csv.Error, ValueError) as e:
+                chunk.append((line_number, f"Malformed row: {e}"))
+                continue
+            chunk.append((line_number, row))
+        yield chunk
+
+
+def _result(line: int, status: str, **kwargs) -> bytes:
+    return orjson.dumps({"line": line, "status": status, **kwargs}) + b"\n"
+
+
+def _validate(chunk, model) -> Tuple[List[bytes], List[Tuple[int, object]]]:
+    errors, valid = [], []
+    for line, row in chunk:
+        if isinstance(row, str):
+            errors.append(_result(line, "error", detail=row))
+            continue
+        try:
+            valid.append((line, model(**row)))
+        except ValidationError as e:
+            errors.append(_result(line, "error", detail=e.errors()))
+    return errors, valid
+
+
+async def import_users(db: AsyncSession, file: UploadFile) -> AsyncIterator[bytes]:
+    created = failed = 0
+    async for chunk in read_rows(file, get_settings().bulk_chunk_size):
+        errors, valid = _validate(chunk, schemas.UserImport)
+        failed += len(errors)
+        for error in errors:
+            yield error
+        # duplicates within the chunk and against the table are reported, not inserted
+        existing = await crud.get_existing_emails(db, [user.email for _, user in valid])
+        rows: Dict[str, Tuple[int, schemas.UserImport]] = {}
+        for line, user in valid:
+            if user.email in existing or user.email in rows:
+                failed += 1
+                yield _result(line, "error", email=user.email, detail="Email already registered")
+            else:
+                rows[user.email] = (line, user)
+        if not rows:
+            continue
+        hashed_passwords = await hash_passwords([user.password for _, user in rows.values()])
+        try:
+            await crud.bulk_create_users(db, users=[
+                {"email": user.email, "hashed_password": hashed_password, "is_active": user.is_active,
+                 "confirmation": None}
+                for (_, user), hashed_password in zip(rows.values(), hashed_passwords)
+            ], role="user")
+        except IntegrityError:
+            # a concurrent insert took one of the emails, the whole chunk was rolled back
+            await db.rollback()
+            failed += len(rows)
+            for line, user in rows.values():
+                yield _result(line, "error", email=user.email, detail="Chunk rolled back, please retry")
+            continue
+        created += len(rows)
+        for line, user in rows.values():
+            yield _result(line, "created", email=user.email)
+    yield orjson.dumps({"created": created, "failed": failed}) + b"\n"
+
+
+async def import_roles(db: AsyncSession, file: UploadFile) -> AsyncIterator[bytes]:
+    created = failed = 0
+    async for chunk in read_rows(file, get_settings().bulk_chunk_size):
+        errors, valid = _validate(chunk, schemas.RoleCreate)
+        failed += len(errors)
+        for error in errors:
+            yield error
+        owner_ids = {role.owner_id for _, role in valid}
+        existing_users = await crud.get_existing_user_ids(db, owner_ids)
+        existing_roles = await crud.get_existing_roles(db, owner_ids)
+        rows: Dict[Tuple[int, str], int] = {}
+        for line, role in valid:
+            key = (role.owner_id, role.role)
+            if role.owner_id not in existing_users:
+                failed += 1
+                yield _result(line, "error", owner_id=role.owner_id, detail="User not found")
+            elif key in existing_roles or key in rows:
+                failed += 1
+                yield _result(line, "error", owner_id=role.owner_id, role=role.role, detail="Role already assigned")
+            else:
+                rows[key] = line
+        if not rows:
+            continue
+        try:
+            await crud.bulk_create_roles(db, roles=[{"owner_id": owner_id, "role": role} for owner_id, role in rows])
+        except IntegrityError:
+            await db.rollback()
+            failed += len(rows)
+            for (owner_id, role), line in rows.items():
+                yield _result(line, "error", owner_id=owner_id, role=role, detail="Chunk rolled back, please retry")
+            continue
+        for owner_id in {owner_id for owner_id, _ in rows}:
+            invalidate_user(owner_id)
+        created += len(rows)
+        for (owner_id, role), line in rows.items():
+            yield _result(line, "created", owner_id=owner_id, role=role)
+    yield orjson.dumps({"created": created, "failed": failed}) + b"\n"
@@ -1,9 +1,179 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
-from smtplib import SMTP
+from functools import lru_cache
+from smtplib import SMTP, SMTPException, SMTPResponseException
+from typing import List, Optional, Set
 
 from app.config import get_settings
+from app.services.metrics import mail_send_duration
 
-settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class MailQueue:
+    """In-process outbound mail queue.
+
+    Handlers only enqueue, a single background worker delivers the messages in
+    batches over one kept-alive SMTP connection. Failed messages are put back on
+    the queue after an exponential backoff, so one failing recipient doesn't hold
+    up the others. The SMTP connection is only ever used from the queue's own
+    thread.
+    """
+
+    def __init__(self, maxsize: int, batch_size: int, max_retries: int, retry_backoff: float,
+                 idle_timeout: float):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.idle_timeout = idle_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._retries: Set[asyncio.TimerHandle] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mailer")
+        self._smtp: Optional[SMTP] = None
+        # emails taken off the queue by the worker and not handed to the server yet
+        self._in_flight = 0
+        self.dropped = 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pending = self.qsize() + self._in_flight
+            logger.warning("Mail queue not drained after %ss, dropping %d emails", timeout, pending)
+            self.dropped += pending
+        if self._retries:
+            logger.warning("Dropping %d emails waiting for a retry", len(self._retries))
+            self.dropped += len(self._retries)
+            for retry in self._retries:
+                retry.cancel()
+            self._retries.clear()
+        # enqueue() drops from now on, like before start
+        self._queue = None
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        # waits for a send still running in the mail thread
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._disconnect)
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def snapshot(self) -> dict:
+        return {"size": self.qsize(), "retrying": len(self._retries), "dropped": self.dropped}
+
+    # raises asyncio.QueueFull when the queue is saturated
+    def enqueue(self, message: EmailMessage):
+        if self._queue is None:
+            # not started, e.g. the app imported by a script
+            self.dropped += 1
+            logger.warning("Mail queue not running, dropping email to %s", message['To'])
+            return
+        self._queue.put_nowait((message, 0))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        # stop() clears self._queue before cancelling the worker
+        queue = self._queue
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                # don't keep an idle connection open forever, the server would drop it anyway
+                await loop.run_in_executor(self._executor, self._disconnect)
+                continue
+            batch = [item]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            self._in_flight = len(batch)
+            try:
+                failed = await loop.run_in_executor(self._executor, self._send_batch, [m for m, _ in batch])
+                attempts = {id(message): attempt for message, attempt in batch}
+                for message in failed:
+                    self._schedule_retry(message, attempts[id(message)] + 1)
+            except Exception:
+                logger.exception("Unexpected error while sending %d emails", len(batch))
+            finally:
+                self._in_flight = 0
+                for _ in batch:
+                    queue.task_done()
+
+    def _schedule_retry(self, message: EmailMessage, attempt: int):
+        if attempt > self.max_retries:
+            self.dropped += 1
+            logger.error("Giving up on the email to %s after %d retries", message['To'], self.max_retries)
+            return
+        delay = self.retry_backoff * 2 ** (attempt - 1)
+        retry = asyncio.get_running_loop().call_later(delay, lambda: self._retry(retry, message, attempt))
+        self._retries.add(retry)
+
+    def _retry(self, retry: asyncio.TimerHandle, message: EmailMessage, attempt: int):
+        self._retries.discard(retry)
+        try:
+            self._queue.put_nowait((message, attempt))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.error("Mail queue full, dropping the retry of the email to %s", message['To'])
+
+    def _send_batch(self, batch: List[EmailMessage]) -> List[EmailMessage]:
+        failed = []
+        for message in batch:
+            started = time.perf_counter()
+            try:
+                self._connection().send_message(message)
+                mail_send_duration.observe(time.perf_counter() - started, "sent")
+            except SMTPResponseException as e:
+                mail_send_duration.observe(time.perf_counter() - started, "failed")
+                if e.smtp_code >= 500:
+                    # permanent failure, retrying won't help
+                    logger.error("Email to %s rejected: %s", message['To'], e)
+                    continue
+                self._disconnect()
+                failed.append(message)
+            except (SMTPException, OSError):
+                mail_send_duration.observe(time.perf_counter() - started, "failed")
+                self._disconnect()
+                failed.append(message)
+        return failed
+
+    def _connection(self) -> SMTP:
+        if self._smtp is None:
+            self._smtp = SMTP(get_settings().smtp_server)
+        return self._smtp
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+
+@lru_cache()
+def get_mail_queue() -> MailQueue:
+    settings = get_settings()
+    return MailQueue(
+        maxsize=settings.mail_queue_size,
+        batch_size=settings.mail_batch_size,
+        max_retries=settings.mail_max_retries,
+        retry_backoff=settings.mail_retry_backoff,
+        idle_timeout=settings.smtp_idle_timeout,
+    )
 
 
 class Mailer:
@@ -12,12 +182,13 @@ class Mailer:
         message = EmailMessage()
         message.set_content(content)
         message['Subject'] = subject
-        message['From'] = settings.mail_sender
+        message['From'] = get_settings().mail_sender
         message['To'] = mail_to
-        SMTP(settings.smtp_server).send_message(message)
+        get_mail_queue().enqueue(message)
 
     @staticmethod
     def send_confirmation_message(token: str, mail_to: str):
+        settings = get_settings()
         confirmation_url = f'{settings.base_url}{settings.api_prefix}/auth/activate_email/{token}'
         message = '''Hi!
     Please confirm your registration: {}.'''.format(confirmation_url)
@@ -29,11 +200,12 @@ class Mailer:
 
     @staticmethod
     def send_password_reset_message(token: str, mail_to: str):
-        confirmation_url = '{}{}/auth/verify/{}'.format(settings.base_url, settings.api_prefix, token)
+        settings = get_settings()
+        reset_url = '{}{}/auth/reset_password/{}'.format(settings.base_url, settings.api_prefix, token)
         message = '''Hi!
-    Please confirm your registration: {}.'''.format(confirmation_url)
+    Reset your password here: {}.'''.format(reset_url)
         Mailer.send_message(
             message,
-            'Please confirm your registration',
+            'Reset your password',
             mail_to
         )
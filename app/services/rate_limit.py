@@ -0,0 +1,180 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException, Request, status
+
+from app.config import get_settings
+
+
+class RateLimitBackend(ABC):
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        """Records a hit for ``key``, returns 0 if it is allowed or else the seconds to wait."""
+
+
+class MemoryBackend(RateLimitBackend):
+    """Token buckets kept in a dict of this worker.
+
+    ``hit`` never awaits, so it runs atomically on the event loop and needs no lock.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> [tokens, updated, time the bucket is full again], each bucket with the limit of its own scope
+        self._buckets: Dict[str, list] = {}
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        now = time.monotonic()
+        rate = limit / window
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+            bucket = self._buckets[key] = [float(limit), now, now]
+        tokens = min(limit, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] = now + (limit - tokens) / rate
+            return (1 - tokens) / rate
+        bucket[0] = tokens - 1
+        bucket[2] = now + (limit - bucket[0]) / rate
+        return 0
+
+    def _prune(self, now: float):
+        # buckets that refilled completely carry no state, drop them first, then the oldest ones
+        for key, (_, _, full_at) in list(self._buckets.items()):
+            if full_at <= now:
+                del self._buckets[key]
+        while len(self._buckets) >= self.max_keys:
+            del self._buckets[next(iter(self._buckets))]
+
+
+class RedisBackend(RateLimitBackend):
+    """Sliding window counter shared by all workers.
+
+    Works with any asyncio client exposing redis' ``incr``, ``expire`` and ``get``
+    (aioredis, redis.asyncio or an in-process fake).
+    """
+
+    def __init__(self, client, prefix: str = "rate-limit:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def hit(self, key: str, limit: int, window: float) -> float:
+        now = time.time()
+        index = int(now // window)
+        elapsed = now - index * window
+        current_key = f"{self.prefix}{key}:{index}"
+        current = await self.client.incr(current_key)
+        if current == 1:
+            await self.client.expire(current_key, math.ceil(window * 2))
+        previous = int(await self.client.get(f"{self.prefix}{key}:{index - 1}") or 0)
+        # weight the previous window by how much of it still overlaps the sliding window
+        if previous * (1 - elapsed / window) + current <= limit:
+            return 0
+        return window - elapsed
+
+
+def create_backend(redis_url: Optional[str]) -> RateLimitBackend:
+    if not redis_url:
+        return MemoryBackend()
+    import aioredis
+    return RedisBackend(aioredis.from_url(redis_url))
+
+
+@lru_cache()
+def get_rate_limit_backend() -> RateLimitBackend:
+    return create_backend(get_settings().rate_limit_redis_url)
+
+
+def too_many_requests(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests, please try again later.",
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+class RateLimit:
+    """Per route limit, either per client IP or per account email.
+
+    The email is read from the already parsed form (``username``) or JSON body
+    (``email``), so the check runs before any DB lookup or password hashing.
+    """
+
+    def __init__(self, scope: str, limit: Optional[int] = None, window: Optional[float] = None, by: str = "ip"):
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+        self.by = by
+
+    # the limit and window come from the settings when the route is hit, not when it is declared
+    @classmethod
+    def per_account(cls, scope: str) -> "RateLimit":
+        return cls(scope, by="email")
+
+    async def _email(self, request: Request) -> Optional[str]:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            try:
+                body = await request.json()
+            except ValueError:
+                return None
+            return body.get("email") if isinstance(body, dict) else None
+        form = await request.form()
+        return form.get("username")
+
+    async def __call__(self, request: Request):
+        settings = get_settings()
+        if not settings.rate_limit_enabled:
+            return
+        if self.by == "email":
+            value = await self._email(request)
+            if not value:
+                return
+            value = value.strip().lower()
+        else:
+            value = request.client.host if request.client else "unknown"
+        limit = self.limit if self.limit is not None else settings.rate_limit_account_requests
+        window = self.window if self.window is not None else settings.rate_limit_account_window
+        retry_after = await get_rate_limit_backend().hit(f"{self.scope}:{self.by}:{value}", limit, window)
+        if retry_after:
+            raise too_many_requests(retry_after)
+
+
+class RateLimitMiddleware:
+    """Per IP limits on a few expensive paths, applied before routing even starts.
+
+    Every path gets rate_limit_ip_requests per rate_limit_ip_window seconds.
+    """
+
+    def __init__(self, app, paths: Iterable[Tuple[str, str]]):
+        self.app = app
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        settings = get_settings()
+        if settings.rate_limit_enabled and (scope["method"], scope["path"]) in self.paths:
+            client = scope.get("client")
+            ip = client[0] if client else "unknown"
+            retry_after = await get_rate_limit_backend().hit(
+                f"{scope['path']}:ip:{ip}", settings.rate_limit_ip_requests, settings.rate_limit_ip_window)
+            if retry_after:
+                await send({
+                    "type": "http.response.start",
+                    "status": status.HTTP_429_TOO_MANY_REQUESTS,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"retry-after", str(math.ceil(retry_after)).encode())],
+                })
+                await send({
+                    "type": "http.response.body",
+                    "body": orjson.dumps({"detail": "Too many requests, please try again later."}),
+                })
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,34 @@
+from functools import lru_cache
+from typing import FrozenSet
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import get_settings
+from app.services.cache import TTLCache
+from app.sql_app import crud
+from app.sql_app.database import SessionLocal, may_read_stale
+
+
+# user id -> frozenset of role names
+@lru_cache()
+def get_role_cache() -> TTLCache:
+    settings = get_settings()
+    return TTLCache(maxsize=settings.role_cache_size, ttl=settings.role_cache_ttl)
+
+
+async def get_role_names(db: AsyncSession, user_id: int) -> FrozenSet[str]:
+    role_cache = get_role_cache()
+    role_names = role_cache.get(user_id)
+    if role_names is None:
+        if may_read_stale(db, user_id):
+            # changed recently, the replica may still have the old roles
+            async with SessionLocal() as primary_db:
+                role_names = frozenset(await crud.get_role_names(primary_db, user_id=user_id))
+        else:
+            role_names = frozenset(await crud.get_role_names(db, user_id=user_id))
+        role_cache.set(user_id, role_names)
+    return role_names
+
+
+def invalidate_roles(user_id: int):
+    get_role_cache().pop(user_id)
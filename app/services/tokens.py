@@ -0,0 +1,221 @@
+import asyncio
+import base64
+import hashlib
+import logging
+import math
+import time
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import config
+from app.config import get_settings
+from app.sql_app import crud
+from app.sql_app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+HMAC_ALGORITHMS = ("HS256", "HS384", "HS512")
+
+
+class TokenError(Exception):
+    pass
+
+
+def b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+class TokenService:
+    """Signs and verifies JWTs with PyJWT, the keys are loaded once.
+
+    HS256/384/512 use the shared secret. RS256 and EdDSA (Ed25519) sign with a
+    private key, so other services can verify tokens with the public key only.
+    PyJWT takes the loaded key objects as they are, no PEM is parsed per token.
+    """
+
+    def __init__(self, algorithm: str, secret_key: Optional[str] = None,
+                 private_key_pem: Optional[bytes] = None, public_key_pem: Optional[bytes] = None):
+        self.algorithm = algorithm
+        self._private_key = self._public_key = None
+        if algorithm in HMAC_ALGORITHMS:
+            if not secret_key:
+                raise ValueError(f"{algorithm} needs a secret key")
+            self._signing_key = self._verifying_key = secret_key.encode()
+        elif algorithm in ("RS256", "EdDSA"):
+            expected_key = rsa.RSAPublicKey if algorithm == "RS256" else ed25519.Ed25519PublicKey
+            if private_key_pem:
+                self._private_key = serialization.load_pem_private_key(private_key_pem, password=None)
+                self._public_key = self._private_key.public_key()
+            if public_key_pem:
+                self._public_key = serialization.load_pem_public_key(public_key_pem)
+            if self._public_key is None:
+                raise ValueError(f"{algorithm} needs a public or private key")
+            if not isinstance(self._public_key, expected_key):
+                raise ValueError(f"The configured key can't be used with {algorithm}")
+            self._signing_key, self._verifying_key = self._private_key, self._public_key
+        else:
+            raise ValueError(f"Unsupported algorithm {algorithm}")
+
+    @classmethod
+    def from_settings(cls, settings: config.Settings) -> "TokenService":
+        def read(path):
+            if not path:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        return cls(
+            algorithm=settings.algorithm,
+            secret_key=settings.secret_key,
+            private_key_pem=read(settings.jwt_private_key_file),
+            public_key_pem=read(settings.jwt_public_key_file),
+        )
+
+    def encode(self, claims: dict) -> str:
+        if self._signing_key is None:
+            raise TokenError("This service can only verify tokens")
+        return jwt.encode(claims, self._signing_key, algorithm=self.algorithm)
+
+    def decode(self, token: str) -> dict:
+        # only the configured algorithm is accepted, whatever the token's header says
+        try:
+            return jwt.decode(token, self._verifying_key, algorithms=[self.algorithm])
+        except jwt.ExpiredSignatureError:
+            raise TokenError("Token has expired")
+        except jwt.InvalidTokenError as e:
+            raise TokenError(str(e))
+
+    def jwks(self) -> dict:
+        if self.algorithm in HMAC_ALGORITHMS:
+            return {"keys": []}
+        if self.algorithm == "RS256":
+            numbers = self._public_key.public_numbers()
+            key = {
+                "kty": "RSA",
+                "n": b64encode(numbers.n.to_bytes((numbers.n.bit_length() + 7) // 8, "big")).decode(),
+                "e": b64encode(numbers.e.to_bytes((numbers.e.bit_length() + 7) // 8, "big")).decode(),
+            }
+        else:
+            raw = self._public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+            key = {"kty": "OKP", "crv": "Ed25519", "x": b64encode(raw).decode()}
+        return {"keys": [{**key, "alg": self.algorithm, "use": "sig"}]}
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        # optimal size and number of hashes for the expected capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationList:
+    """In-memory denylist of revoked token ids (jti), synced from the database.
+
+    With ``use_bloom`` only a Bloom filter is kept in memory, a hit is then
+    confirmed against the database so a false positive never rejects a token.
+    Revocations made by another worker are seen after at most one sync interval.
+    """
+
+    def __init__(self, sync_interval: float, use_bloom: bool = False, bloom_capacity: int = 100000,
+                 prune_interval: float = 3600):
+        self.sync_interval = sync_interval
+        self.prune_interval = prune_interval
+        self._pruned_at = time.monotonic()
+        self.use_bloom = use_bloom
+        self.bloom_capacity = bloom_capacity
+        self._jtis = set()
+        self._bloom = BloomFilter(bloom_capacity) if use_bloom else None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, jti: str):
+        if self._bloom is not None:
+            self._bloom.add(jti)
+        else:
+            self._jtis.add(jti)
+
+    async def is_revoked(self, db: AsyncSession, jti: str) -> bool:
+        if self._bloom is None:
+            return jti in self._jtis
+        if jti not in self._bloom:
+            return False
+        return await crud.is_token_revoked(db, jti=jti)
+
+    async def sync(self):
+        async with SessionLocal() as db:
+            jtis = await crud.get_revoked_jtis(db, now=datetime.utcnow())
+        if self._bloom is not None:
+            bloom = BloomFilter(max(self.bloom_capacity, len(jtis)))
+            for jti in jtis:
+                bloom.add(jti)
+            self._bloom = bloom
+        else:
+            self._jtis = set(jtis)
+
+    async def prune(self):
+        # expired tokens are rejected anyway, their rows only slow the sync down
+        async with SessionLocal() as db:
+            deleted = await crud.delete_expired_revoked_tokens(db, now=datetime.utcnow())
+        if deleted:
+            logger.info("Pruned %d expired revoked tokens", deleted)
+
+    async def _sync(self):
+        try:
+            await self.sync()
+        except Exception:
+            logger.exception("Could not sync the token revocation list")
+        if time.monotonic() - self._pruned_at >= self.prune_interval:
+            # every worker prunes, deleting rows another one already deleted is harmless
+            self._pruned_at = time.monotonic()
+            try:
+                await self.prune()
+            except Exception:
+                logger.exception("Could not prune the revoked tokens")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self._sync()
+
+    async def start(self):
+        # loaded before the first request, refreshed in the background afterwards
+        await self._sync()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+@lru_cache()
+def get_token_service() -> TokenService:
+    return TokenService.from_settings(get_settings())
+
+
+@lru_cache()
+def get_revocation_list() -> RevocationList:
+    settings = get_settings()
+    return RevocationList(
+        sync_interval=settings.token_revocation_sync_interval,
+        use_bloom=settings.token_revocation_bloom_filter,
+        prune_interval=settings.token_revocation_prune_interval,
+    )
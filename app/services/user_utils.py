@@ -1,32 +1,175 @@
+import asyncio
+import base64
+import binascii
+import csv
+import hashlib
+import io
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException, Response
+from fastapi.responses import ORJSONResponse
+
+from app.config import get_settings
+from app.services.cache import TTLCache
 from app.sql_app import crud
+from app.sql_app import models
 from app.sql_app import schemas
+from app.sql_app.database import ReadSessionLocal
+
+
+# Response bodies are built once as plain dicts straight from the ORM objects and handed to orjson.
+# Data coming from the database is trusted, so it is not validated against schemas.User again.
+def serialize_user(user: models.User, include_confirmation: bool = True,
+                   role_names: Optional[Iterable[str]] = None) -> dict:
+    return {
+        "email": user.email,
+        "id": user.id,
+        "is_active": user.is_active,
+        "confirmation": user.confirmation if include_confirmation else None,
+        "roles": [r.role for r in user.roles] if role_names is None else sorted(role_names),
+    }
+
+
+def build_user_response(user: models.User, include_confirmation: bool = True,
+                        role_names: Optional[Iterable[str]] = None) -> schemas.User:
+    return schemas.User.construct(**serialize_user(user, include_confirmation=include_confirmation,
+                                                   role_names=role_names))
+
+
+def user_etag(user_id: int, version: int) -> str:
+    return f'"{user_id}-{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # weak comparison, as If-None-Match asks for
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def user_json_response(user: models.User) -> ORJSONResponse:
+    return ORJSONResponse(serialize_user(user), headers={"ETag": user_etag(user.id, user.version)})
+
+
+# keyed by version, so an entry is never stale, only evicted
+@lru_cache()
+def get_user_response_cache() -> TTLCache:
+    settings = get_settings()
+    return TTLCache(maxsize=settings.user_response_cache_size, ttl=settings.user_response_cache_ttl)
+
+
+# (user id, version) -> load of its body that is in progress
+_user_body_loads: Dict[Tuple[int, int], "asyncio.Task"] = {}
+
+
+# own session: the load outlives the request that started it when that one is cancelled
+async def _load_user_body(user_id: int) -> Optional[Tuple[int, bytes]]:
+    async with ReadSessionLocal() as db:
+        user = await crud.get_user_with_roles(db, user_id=user_id)
+        if user is None:
+            return None
+        body = orjson.dumps(serialize_user(user))
+    get_user_response_cache().set((user_id, user.version), body)
+    return user.version, body
+
+
+# Polled constantly: answered with a 304 after a version lookup when the client is up to date,
+# otherwise with the body of that version (cached) or a freshly loaded one.
+async def get_user_conditional_response(db, user_id: int, if_none_match: Optional[str]) -> Response:
+    version = await crud.get_user_version(db, user_id=user_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    etag = user_etag(user_id, version)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    body = get_user_response_cache().get((user_id, version))
+    if body is None:
+        # concurrent misses (a cold worker, a client burst) wait for one load instead of all querying.
+        # The load is shielded so a cancelled request doesn't cancel it for the others
+        key = (user_id, version)
+        load = _user_body_loads.get(key)
+        if load is None:
+            load = _user_body_loads[key] = asyncio.get_running_loop().create_task(_load_user_body(user_id))
+            load.add_done_callback(lambda _: _user_body_loads.pop(key, None))
+        loaded = await asyncio.shield(load)
+        if loaded is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        # the user may have changed since the version lookup, the ETag follows the body
+        version, body = loaded
+        etag = user_etag(user_id, version)
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+# /users/me comes from the principal get_current_user already holds, without a query. Its ETag is a
+# hash of the body, the principal is dropped from the cache whenever the user's version goes up.
+def principal_conditional_response(principal: schemas.User, if_none_match: Optional[str]) -> Response:
+    body = orjson.dumps(principal.dict())
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
+# keyset paginated listings (users, audit events)
+MAX_PAGE_SIZE = 500
+
+
+# Opaque cursors, clients should not rely on them being the sort key of the last row on the page
+def encode_cursor(*key) -> str:
+    return base64.urlsafe_b64encode("|".join(str(part) for part in key).encode()).decode().rstrip("=")
+
+
+# parses each part of the key with the matching type, e.g. decode_cursor(cursor, int)
+def decode_cursor(cursor: str, *types: Callable[[str], Any]) -> tuple:
+    try:
+        parts = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|")
+        if len(parts) != len(types):
+            raise ValueError(cursor)
+        return tuple(parse(part) for parse, part in zip(types, parts))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# rows are fetched with limit + 1, the extra row only tells whether there is a next page
+def paginate(rows: list, limit: int, key: Callable[[Any], tuple]) -> Tuple[list, Optional[str]]:
+    next_cursor = encode_cursor(*key(rows[limit - 1])) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+async def get_all_users_response(db, cursor: Optional[str], limit: int,
+                                 email_prefix: Optional[str] = None) -> ORJSONResponse:
+    after_id = decode_cursor(cursor, int)[0] if cursor else 0
+    if after_id < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    users = await crud.get_users_with_roles(db=db, after_id=after_id, limit=limit + 1, email_prefix=email_prefix)
+    users, next_cursor = paginate(users, limit, key=lambda user: (user.id,))
+    return ORJSONResponse({
+        "users": [serialize_user(user, include_confirmation=False) for user in users],
+        "next_cursor": next_cursor,
+    })
+
+
+EXPORT_COLUMNS = ["id", "email", "is_active", "roles"]
 
 
-def get_user_response(db, user_id) -> schemas.User:
-    user = crud.get_user(db=db, user_id=user_id)
-    user_roles = crud.get_user_roles(db=db, user_id=user_id)
-    role_names = [r.role for r in user_roles]
-    response = schemas.User(
-        id=user.id,
-        email=user.email,
-        is_active=user.is_active,
-        confirmation=user.confirmation,
-        roles=role_names
-    )
-    return response
-
-
-def get_all_users_response(db, skip: int, limit: int) -> schemas.User:
-    users = crud.get_users(db=db, skip=skip, limit=limit)
-    users_data = []
-    for user in users:
-        user_roles = crud.get_user_roles(db=db, user_id=user.id)
-        role_names = [r.role for r in user_roles]
-        user_data = schemas.User(
-            id=user.id,
-            email=user.email,
-            is_active=user.is_active,
-            roles=role_names
-        )
-        users_data.append(user_data)
-    return users_data
+# Rows are encoded one batch at a time, memory use doesn't depend on the size of the table
+async def export_users(db, export_format: str, batch_size: int = 1000) -> AsyncIterator[bytes]:
+    if export_format == "csv":
+        yield (",".join(EXPORT_COLUMNS) + "\r\n").encode()
+    async for rows in crud.stream_users_export(db, batch_size=batch_size):
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            # the roles cell is a JSON array, no separator a role name couldn't contain
+            writer.writerows(
+                (user_id, email, is_active, orjson.dumps(roles).decode()) for user_id, email, is_active, roles in rows
+            )
+            yield buffer.getvalue().encode()
+        else:
+            yield b"".join(
+                orjson.dumps({"id": user_id, "email": email, "is_active": is_active, "roles": roles}) + b"\n"
+                for user_id, email, is_active, roles in rows
+            )
@@ -1,56 +1,328 @@
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, bindparam, delete, func, insert, or_, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from . import models, schemas
 
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+async def get_user(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.User).filter(models.User.id == user_id))
+    return result.scalars().first()
+
+
+# Roles can't be lazy loaded on an AsyncSession, ask for them up front when the caller needs them
+async def get_user_by_email(db: AsyncSession, email: str, with_roles: bool = False):
+    query = select(models.User).filter(models.User.email == email)
+    if with_roles:
+        query = query.options(selectinload(models.User.roles))
+    result = await db.execute(query)
+    return result.scalars().first()
+
+
+# Smallest string sorting after every string that starts with prefix (code point order, the order of
+# UTF-8 bytes), None when there is no such string
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    while prefix:
+        code_point = ord(prefix[-1]) + 1
+        if code_point <= 0x10FFFF:
+            # surrogates can't be encoded, the next character is the first one after them
+            return prefix[:-1] + chr(0xE000 if 0xD800 <= code_point <= 0xDFFF else code_point)
+        prefix = prefix[:-1]
+    return None
+
+
+# An email prefix is a range on the email index: LIKE can't use a btree index with a bound pattern on
+# postgres (or with a non-C collation at all), nor on SQLite with its default case-insensitive LIKE.
+# Postgres compares byte-wise with the text_pattern_ops operators its ix_users_email is built with.
+def _email_prefix_filter(dialect: str, prefix: str):
+    email = models.User.email
+    if dialect == "postgresql":
+        greater_equal, less = email.op("~>=~", is_comparison=True), email.op("~<~", is_comparison=True)
+    else:
+        greater_equal, less = email.__ge__, email.__lt__
+    upper_bound = _prefix_upper_bound(prefix)
+    if upper_bound is None:
+        return greater_equal(prefix)
+    return and_(greater_equal(prefix), less(upper_bound))
 
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
+# Keyset pagination on the primary key, deep pages cost the same as the first one
+def _users_page_query(dialect: str, after_id: int, limit: int, email_prefix: Optional[str]):
+    query = select(models.User).filter(models.User.id > after_id)
+    if email_prefix:
+        query = query.filter(_email_prefix_filter(dialect, email_prefix))
+    return query.order_by(models.User.id).limit(limit)
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+# Users with their roles loaded in one extra SELECT ... WHERE owner_id IN (...) for the whole batch
+async def get_user_with_roles(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(models.User).options(selectinload(models.User.roles)).filter(models.User.id == user_id)
+    )
+    return result.scalars().first()
 
 
-def create_user(db: Session, user: schemas.UserCreate, hashed_password: str, confirmation: str):
-    db_user = models.User(email=user.email, hashed_password=hashed_password)
+async def get_users_with_roles(db: AsyncSession, after_id: int = 0, limit: int = 100,
+                               email_prefix: Optional[str] = None):
+    result = await db.execute(
+        _users_page_query(db.bind.dialect.name, after_id, limit, email_prefix).options(selectinload(models.User.roles))
+    )
+    return result.scalars().all()
 
-    db_user.confirmation = confirmation
+
+# The IntegrityError of the unique email index: named by the index on postgres, by the column on SQLite
+def _is_duplicate_email(error: IntegrityError) -> bool:
+    message = str(error.orig)
+    return "ix_users_email" in message or "users.email" in message
+
+
+# Inserts the user and its roles in a single transaction, returns None when the email is already taken.
+# before_commit(user) runs once the rows are inserted, the transaction is rolled back when it raises.
+async def create_user_with_roles(db: AsyncSession, user: schemas.UserCreate, hashed_password: str,
+                                 confirmation: str, roles: List[str],
+                                 before_commit: Optional[Callable[[models.User], None]] = None):
+    db_user = models.User(email=user.email, hashed_password=hashed_password, confirmation=confirmation,
+                          is_active=False, roles=[models.Role(role=role) for role in roles])
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    try:
+        await db.flush()
+    except IntegrityError as e:
+        await db.rollback()
+        if _is_duplicate_email(e):
+            return None
+        raise
+    try:
+        if before_commit is not None:
+            before_commit(db_user)
+    except BaseException:
+        await db.rollback()
+        raise
+    await db.commit()
     return db_user
 
-def create_admin_user(db: Session, email:str, hashed_password: str):
-    db_user = models.User(email=email, hashed_password=hashed_password)
-    db_user.confirmation = None
-    db_user.is_active = True
+
+ADMIN_SEED_LOCK = 0x61646d6e
+
+
+# Creates the admin and its role in one transaction, returns None when the email is already taken.
+# On postgres concurrent seeders are serialized with an advisory lock, released at commit/rollback.
+async def create_admin_user(db: AsyncSession, email: str, hashed_password: str):
+    if db.bind.dialect.name == "postgresql":
+        await db.execute(select(func.pg_advisory_xact_lock(ADMIN_SEED_LOCK)))
+    if await get_user_by_email(db, email=email):
+        await db.rollback()
+        return None
+    db_user = models.User(email=email, hashed_password=hashed_password, confirmation=None, is_active=True,
+                          roles=[models.Role(role="admin")])
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    try:
+        await db.commit()
+    except IntegrityError as e:
+        await db.rollback()
+        if _is_duplicate_email(e):
+            return None
+        raise
     return db_user
 
 
-def update_user(db: Session, user_id: int, updated_user=schemas.User):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+# The version goes up with every change that shows in a user response, ETags are derived from it.
+# It is incremented in SQL and read back before the commit, so two changes never end up with the same version.
+async def _bump_version(db: AsyncSession, user: models.User):
+    user.version = models.User.version + 1
+    await db.flush()
+    await db.refresh(user, attribute_names=["version"])
+
+
+async def _bump_versions(db: AsyncSession, user_ids: Iterable[int]):
+    await db.execute(
+        update(models.User)
+        .where(models.User.id.in_(list(user_ids)))
+        .values(version=models.User.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def get_user_version(db: AsyncSession, user_id: int) -> Optional[int]:
+    result = await db.execute(select(models.User.version).filter(models.User.id == user_id))
+    return result.scalar()
+
+
+async def update_user(db: AsyncSession, user_id: int, updated_user=schemas.User):
+    db_user = await get_user_with_roles(db, user_id=user_id)
     update_user_encoded = jsonable_encoder(updated_user)
     db_user.update(**update_user_encoded)
-    db.commit()
+    await _bump_version(db, db_user)
+    await db.commit()
     return db_user
 
 
+async def activate_user(db: AsyncSession, user: models.User):
+    user.confirmation = None
+    user.is_active = True
+    await _bump_version(db, user)
+    await db.commit()
+    return user
+
+
+async def set_password(db: AsyncSession, user: models.User, hashed_password: str):
+    user.hashed_password = hashed_password
+    await _bump_version(db, user)
+    await db.commit()
+    return user
+
+
+# Swaps in a rehashed password, unless the password was changed in the meantime
+async def update_password_hash(db: AsyncSession, user_id: int, old_hash: str, new_hash: str):
+    await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.hashed_password == old_hash)
+        .values(hashed_password=new_hash)
+    )
+    await db.commit()
+
+
+# Last login / last seen times, one executemany per column. A time never replaces a newer one,
+# another worker may flush its buffer later than this one
+async def update_activity(db: AsyncSession, logins: Dict[int, datetime], seen: Dict[int, datetime]):
+    users = models.User.__table__
+    for column, times in ((users.c.last_login_at, logins), (users.c.last_seen_at, seen)):
+        if not times:
+            continue
+        await db.execute(
+            users.update()
+            .where(users.c.id == bindparam("user_id"), or_(column.is_(None), column < bindparam("at")))
+            .values({column: bindparam("at")}),
+            [{"user_id": user_id, "at": at} for user_id, at in times.items()],
+        )
+    await db.commit()
+
+
 # Roles
-def create_user_role(db: Session, role: schemas.RoleCreate):
+# Returns None when the user already has the role (or doesn't exist)
+async def create_user_role(db: AsyncSession, role: schemas.RoleCreate):
     db_role = models.Role(**role.dict())
     db.add(db_role)
-    db.commit()
-    db.refresh(db_role)
+    try:
+        await db.flush()
+        await _bump_versions(db, [role.owner_id])
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return None
     return db_role
 
 
-def get_user_roles(db: Session, user_id: int):
-    return db.query(models.Role).filter(models.Role.owner_id == user_id).all()
+async def get_user_roles(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.Role).filter(models.Role.owner_id == user_id))
+    return result.scalars().all()
+
+
+async def get_role_names(db: AsyncSession, user_id: int) -> List[str]:
+    result = await db.execute(select(models.Role.role).filter(models.Role.owner_id == user_id))
+    return result.scalars().all()
+
+
+# Revoked tokens
+async def revoke_token(db: AsyncSession, jti: str, expires_at: datetime):
+    db.add(models.RevokedToken(jti=jti, expires_at=expires_at))
+    try:
+        await db.commit()
+    except IntegrityError:
+        # already revoked
+        await db.rollback()
+
+
+async def get_revoked_jtis(db: AsyncSession, now: datetime) -> List[str]:
+    result = await db.execute(select(models.RevokedToken.jti).filter(models.RevokedToken.expires_at > now))
+    return result.scalars().all()
+
+
+async def delete_expired_revoked_tokens(db: AsyncSession, now: datetime) -> int:
+    result = await db.execute(delete(models.RevokedToken).filter(models.RevokedToken.expires_at <= now))
+    await db.commit()
+    return result.rowcount
+
+
+async def is_token_revoked(db: AsyncSession, jti: str) -> bool:
+    return await db.get(models.RevokedToken, jti) is not None
+
+
+# Whole user directory with role names aggregated in SQL, streamed through a server-side cursor.
+# Yields batches of (id, email, is_active, sorted role names). The names are aggregated into an array,
+# not joined on a separator, so they may contain any character.
+async def stream_users_export(db: AsyncSession, batch_size: int = 1000):
+    postgres = db.bind.dialect.name == "postgresql"
+    if postgres:
+        role_names = func.array_agg(models.Role.role)
+    else:
+        role_names = func.json_group_array(models.Role.role)
+    query = select(models.User.id, models.User.email, models.User.is_active, role_names.label("roles")) \
+        .outerjoin(models.Role, models.Role.owner_id == models.User.id) \
+        .group_by(models.User.id) \
+        .order_by(models.User.id)
+    result = await db.stream(query)
+    async for rows in result.partitions(batch_size):
+        # users without roles aggregate the outer join's single NULL
+        yield [
+            (row.id, row.email, row.is_active,
+             sorted(role for role in (row.roles if postgres else orjson.loads(row.roles)) if role is not None))
+            for row in rows
+        ]
+
+
+# Bulk imports, every call is one executemany per table and a single commit
+async def get_existing_emails(db: AsyncSession, emails: Iterable[str]) -> Set[str]:
+    result = await db.execute(select(models.User.email).filter(models.User.email.in_(list(emails))))
+    return set(result.scalars().all())
+
+
+async def get_existing_user_ids(db: AsyncSession, user_ids: Iterable[int]) -> Set[int]:
+    result = await db.execute(select(models.User.id).filter(models.User.id.in_(list(user_ids))))
+    return set(result.scalars().all())
+
+
+async def get_existing_roles(db: AsyncSession, user_ids: Iterable[int]) -> Set[Tuple[int, str]]:
+    result = await db.execute(
+        select(models.Role.owner_id, models.Role.role).filter(models.Role.owner_id.in_(list(user_ids)))
+    )
+    return set(result.all())
+
+
+async def bulk_create_users(db: AsyncSession, users: List[dict], role: str):
+    await db.execute(insert(models.User), users)
+    result = await db.execute(select(models.User.id).filter(models.User.email.in_([u["email"] for u in users])))
+    await db.execute(insert(models.Role), [{"owner_id": user_id, "role": role} for user_id in result.scalars()])
+    await db.commit()
+
+
+async def bulk_create_roles(db: AsyncSession, roles: List[dict]):
+    await db.execute(insert(models.Role), roles)
+    await _bump_versions(db, {role["owner_id"] for role in roles})
+    await db.commit()
+
+
+# Audit events, written in batches by services.audit
+async def create_audit_events(db: AsyncSession, events: List[dict]):
+    await db.execute(insert(models.AuditEvent), events)
+    await db.commit()
+
+
+# Newest first, keyset pagination on (created_at, id)
+async def get_audit_events(db: AsyncSession, before: Optional[Tuple[datetime, int]] = None, limit: int = 100,
+                           action: Optional[str] = None, subject_id: Optional[int] = None):
+    query = select(models.AuditEvent)
+    if before is not None:
+        query = query.filter(tuple_(models.AuditEvent.created_at, models.AuditEvent.id) < tuple_(*before))
+    if action is not None:
+        query = query.filter(models.AuditEvent.action == action)
+    if subject_id is not None:
+        query = query.filter(models.AuditEvent.subject_id == subject_id)
+    query = query.order_by(models.AuditEvent.created_at.desc(), models.AuditEvent.id.desc()).limit(limit)
+    result = await db.execute(query)
+    return result.scalars().all()
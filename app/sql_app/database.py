@@ -1,21 +1,291 @@
-from sqlalchemy import create_engine
+import asyncio
+import logging
+import time
+from contextlib import AsyncExitStack
+from itertools import count
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from app.config import get_settings
+from app.services.metrics import instrument_engine
+
+logger = logging.getLogger(__name__)
+
+# sync DBAPI -> asyncio DBAPI, aiosqlite is only meant as a local/test stand-in
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(database_url: str):
+    url = make_url(database_url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.in_use_max = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+
+    def observe_wait(self, wait: float):
+        self.checkouts += 1
+        self.checkout_wait_total += wait
+        self.checkout_wait_max = max(self.checkout_wait_max, wait)
+
+    def snapshot(self, pool) -> dict:
+        snapshot = {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "in_use": self.in_use,
+            "in_use_max": self.in_use_max,
+            "checkout_wait_avg_seconds": self.checkout_wait_total / (self.checkouts or 1),
+            "checkout_wait_max_seconds": self.checkout_wait_max,
+        }
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            snapshot.update(size=pool.size(), overflow=pool.overflow(), idle=pool.checkedin())
+        return snapshot
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long callers wait for a connection."""
+
+    def _do_get(self):
+        started = time.monotonic()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.observe_wait(time.monotonic() - started)
+
+
+def get_engine_options(database_url) -> dict:
+    settings = get_settings()
+    if database_url.get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": InstrumentedPool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.in_use += 1
+    pool_metrics.in_use_max = max(pool_metrics.in_use_max, pool_metrics.in_use)
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    pool_metrics.in_use -= 1
+
+
+class ReplicaSet:
+    """Read replicas handed out round-robin, replicas failing the periodic health check are skipped."""
+
+    def __init__(self, engines: List[AsyncEngine], check_interval: float, check_timeout: float):
+        self.engines = engines
+        self.healthy = set(range(len(engines)))
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._next = count()
+        self._task = None
+
+    def choose(self) -> Optional[AsyncEngine]:
+        healthy = sorted(self.healthy)
+        if not healthy:
+            return None
+        return self.engines[healthy[next(self._next) % len(healthy)]]
+
+    async def _ping(self, index: int):
+        async with self.engines[index].connect() as conn:
+            await conn.exec_driver_sql("SELECT 1")
+
+    async def _check(self, index: int):
+        try:
+            # the timeout covers the connect too, an unreachable replica can hang there
+            await asyncio.wait_for(self._ping(index), timeout=self.check_timeout)
+        except Exception as e:
+            if index in self.healthy:
+                logger.warning("Read replica %s is unhealthy, reading from the others: %r", index, e)
+            self.healthy.discard(index)
+        else:
+            if index not in self.healthy:
+                logger.warning("Read replica %s is healthy again", index)
+            self.healthy.add(index)
+
+    async def check(self):
+        await asyncio.gather(*(self._check(index) for index in range(len(self.engines))))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    async def start(self):
+        await self.check()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def dispose(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for replica in self.engines:
+            await replica.dispose()
+
+
+class RoutingSession(Session):
+    """Sends the reads of read-only sessions to a replica and everything else to the primary.
+
+    A request that committed on the primary reads from the primary from then on, so it sees its own writes.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("read_only") and replicas is not None and not self._flushing \
+                and not getattr(self.info.get("request_state"), "read_from_primary", False):
+            # one replica per session, so its statements share a connection and a snapshot
+            replica = self.info.get("replica") or replicas.choose()
+            if replica is not None:
+                self.info["replica"] = replica
+                return replica.sync_engine
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _pin_to_primary(session):
+    request_state = session.info.get("request_state")
+    if request_state is not None:
+        request_state.read_from_primary = True
+
+
+# objects stay usable after commit so responses can be built without re-reading them
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, class_=AsyncSession,
+                            sync_session_class=RoutingSession)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, class_=AsyncSession,
+                                sync_session_class=RoutingSession, info={"read_only": True})
+
+engine: Optional[AsyncEngine] = None
+replicas: Optional[ReplicaSet] = None
+# user id -> time.monotonic() until which the caches of that user are filled from the primary
+_primary_reads_until = {}
+
+
+def read_user_from_primary(user_id: int):
+    """Called when a user changes, a replica may return the old rows for up to db_replica_max_lag seconds."""
+    if replicas is None:
+        return
+    now = time.monotonic()
+    for expired in [key for key, until in _primary_reads_until.items() if until <= now]:
+        del _primary_reads_until[expired]
+    _primary_reads_until[user_id] = now + get_settings().db_replica_max_lag
+
+
+def may_read_stale(db: AsyncSession, user_id: int) -> bool:
+    """Whether db reads from a replica that may not have the last change of the user yet."""
+    if not db.info.get("read_only") or replicas is None \
+            or getattr(db.info.get("request_state"), "read_from_primary", False):
+        return False
+    return _primary_reads_until.get(user_id, 0) > time.monotonic()
+
+
+# SQLite ignores foreign keys unless asked to, crud relies on them like on postgres (e.g. a role for an unknown user)
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def _create_engine(database_url: str) -> AsyncEngine:
+    database_url = get_async_database_url(database_url)
+    db_engine = create_async_engine(database_url, **get_engine_options(database_url))
+    if database_url.get_backend_name() == "sqlite":
+        event.listen(db_engine.sync_engine, "connect", _enable_foreign_keys)
+    event.listen(db_engine.sync_engine, "checkout", _on_checkout)
+    event.listen(db_engine.sync_engine, "checkin", _on_checkin)
+    instrument_engine(db_engine.sync_engine)
+    return db_engine
+
+
+def init_db() -> AsyncEngine:
+    """Creates the engines of this process, workers call it on startup so no pool is inherited from a parent."""
+    global engine, replicas
+    if engine is None:
+        settings = get_settings()
+        engine = _create_engine(settings.sqlalchemy_database_url)
+        if settings.sqlalchemy_replica_urls:
+            replicas = ReplicaSet([_create_engine(url) for url in settings.sqlalchemy_replica_urls],
+                                  check_interval=settings.db_replica_check_interval,
+                                  check_timeout=settings.db_replica_check_timeout)
+        SessionLocal.configure(bind=engine)
+        ReadSessionLocal.configure(bind=engine)
+    return engine
+
+
+async def start_replica_checks():
+    if replicas is not None:
+        await replicas.start()
+
+
+def pool_snapshot() -> dict:
+    snapshot = pool_metrics.snapshot(engine.sync_engine.pool if engine is not None else None)
+    if replicas is not None:
+        snapshot.update(replicas=len(replicas.engines), replicas_healthy=len(replicas.healthy))
+    return snapshot
+
+
+async def warm_pool(connections: int):
+    """Opens the connections up front so the first requests don't pay for the connects."""
+    if connections <= 0:
+        return
+    db_engine = init_db()
+    async with AsyncExitStack() as stack:
+        # the first connect initializes the dialect, it can't run concurrently. It stays checked out,
+        # or one of the others would just reuse it
+        await stack.enter_async_context(db_engine.connect())
+        await asyncio.gather(*(stack.enter_async_context(db_engine.connect()) for _ in range(connections - 1)))
+
+
+async def dispose_db():
+    global engine, replicas
+    if replicas is not None:
+        await replicas.dispose()
+        replicas = None
+    if engine is not None:
+        await engine.dispose()
+        engine = None
 
-engine = create_engine(
-    get_settings().sqlalchemy_database_url
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
 
 # Dependencies
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db(request: Request):
+    async with SessionLocal(info={"request_state": request.state}) as db:
+        yield db
+
+
+# for read-only routes, served by a replica when there are any
+async def get_read_db(request: Request):
+    async with ReadSessionLocal(info={"request_state": request.state}) as db:
         yield db
-    finally:
-        db.close()
@@ -1,20 +1,54 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey
+import uuid
+
+from sqlalchemy import JSON, BigInteger, Boolean, Column, DateTime, Index, Integer, String, ForeignKey
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import CHAR, TypeDecorator
 
 from .database import Base
 
 
+class GUID(TypeDecorator):
+    """Native UUID on PostgreSQL, CHAR(32) hex elsewhere (the SQLite stand-in)."""
+    impl = CHAR
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(UUID(as_uuid=True))
+        return dialect.type_descriptor(CHAR(32))
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name == "postgresql":
+            return value
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(str(value))
+        return value.hex
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        return uuid.UUID(value)
+
+
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True)
+    id = Column(Integer, primary_key=True)
+    email = Column(String)
     hashed_password = Column(String)
-    confirmation = Column(UUID(as_uuid=True), nullable=True)
+    confirmation = Column(GUID(), nullable=True)
     is_active = Column(Boolean, default=False)
+    # bumped by crud on every change to the user or its roles, see crud._bump_version
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # written in batches by services.activity, not part of the user responses (and their version)
+    last_login_at = Column(DateTime, nullable=True)
+    last_seen_at = Column(DateTime, nullable=True)
     roles = relationship("Role", back_populates="owner")
 
+    # text_pattern_ops on postgres: byte-wise, so it also serves the email prefix ranges of crud
+    __table_args__ = (Index("ix_users_email", "email", unique=True, postgresql_ops={"email": "text_pattern_ops"}),)
+
     def update(self, **kwargs):
         for key, value in kwargs.items():
             if hasattr(self, key):
@@ -24,8 +58,41 @@ class User(Base):
 class Role(Base):
     __tablename__ = "roles"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     role = Column(String, index=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
 
     owner = relationship("User", back_populates="roles")
+
+    # every role lookup filters on owner_id, the unique index serves those and stops duplicates
+    __table_args__ = (Index("ix_roles_owner_id_role", "owner_id", "role", unique=True),)
+
+
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    jti = Column(String(32), primary_key=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class AuditEvent(Base):
+    __tablename__ = "audit_events"
+
+    # BIGINT on postgres, SQLite only autoincrements an INTEGER primary key
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    # when it happened, not when services.audit got around to inserting it
+    created_at = Column(DateTime, nullable=False)
+    action = Column(String(64), nullable=False)
+    # no foreign keys: the trail outlives deleted users and inserts stay cheap
+    actor_id = Column(Integer, nullable=True)
+    subject_id = Column(Integer, nullable=True)
+    email = Column(String, nullable=True)
+    ip = Column(String(45), nullable=True)
+    detail = Column(JSON, nullable=True)
+
+    # keyset pagination, newest first, over all events, the events of one user or of one action
+    __table_args__ = (
+        Index("ix_audit_events_created_at_id", "created_at", "id"),
+        Index("ix_audit_events_subject_id_created_at_id", "subject_id", "created_at", "id"),
+        Index("ix_audit_events_action_created_at_id", "action", "created_at", "id"),
+    )
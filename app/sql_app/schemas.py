@@ -1,4 +1,5 @@
-from typing import Optional, List
+from datetime import datetime
+from typing import Any, Dict, Optional, List
 
 from pydantic import BaseModel, EmailStr, UUID4
 
@@ -26,6 +27,10 @@ class UserCreate(UserBase):
     password: str
 
 
+class UserImport(UserCreate):
+    is_active: bool = True
+
+
 class UserUpdate(BaseModel):
     email: Optional[EmailStr]
 
@@ -40,6 +45,11 @@ class User(UserBase):
         orm_mode = True
 
 
+class UserPage(BaseModel):
+    users: List[User]
+    next_cursor: Optional[str] = None
+
+
 # Token Schema
 class Token(BaseModel):
     access_token: str
@@ -51,4 +61,23 @@ class TokenData(BaseModel):
 
 # reset password Schema
 class ResetPassword(BaseModel):
-    password:str
\ No newline at end of file
+    password:str
+
+# Audit schema
+class AuditEvent(BaseModel):
+    id: int
+    created_at: datetime
+    action: str
+    actor_id: Optional[int]
+    subject_id: Optional[int]
+    email: Optional[str]
+    ip: Optional[str]
+    detail: Optional[Dict[str, Any]]
+
+    class Config:
+        orm_mode = True
+
+
+class AuditEventPage(BaseModel):
+    events: List[AuditEvent]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,15 @@
+import os
+
+# Settings needed to import the app without a .env file, real values win when present
+BENCHMARK_ENV = {
+    "SQLALCHEMY_DATABASE_URL": "sqlite:///./benchmark.db",
+    "SECRET_KEY": "benchmark-secret",
+    "SMTP_SERVER": "localhost:1025",
+    "APP_NAME": "benchmark",
+}
+
+
+def setup_env(**overrides):
+    for key, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(key, value)
+    os.environ.update(overrides)
@@ -0,0 +1,69 @@
+"""Cold import time of the app, measured with ``python -X importtime``.
+
+Imports the module in fresh interpreters, prints the slowest modules and fails
+when the median import takes longer than --budget milliseconds or when one of
+the modules that should only be loaded on first use is imported eagerly.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --module app.cli --budget 400
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from benchmarks._env import BENCHMARK_ENV
+
+# loaded on first use (hashing, process pools), never while importing the app
+LAZY_MODULES = ("passlib", "concurrent.futures.process")
+
+
+def import_times(module: str) -> dict:
+    """Cumulative microseconds per imported module for one cold import."""
+    env = {**BENCHMARK_ENV, **os.environ}
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            env=env, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package", the first line is the header
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1500, help="max median import time in ms")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    per_module = defaultdict(list)
+    for times in runs:
+        for name, cumulative in times.items():
+            per_module[name].append(cumulative)
+    total = statistics.median(times[args.module] for times in runs) / 1000
+    print(f"{args.module}: {total:.1f}ms (median of {args.runs})")
+    slowest = sorted(per_module.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, values in slowest[1:args.top + 1]:
+        print(f"  {statistics.median(values) / 1000:8.1f}ms  {name}")
+
+    failures = []
+    if total > args.budget:
+        failures.append(f"{args.module} takes {total:.1f}ms to import, budget {args.budget}ms")
+    for name in LAZY_MODULES:
+        if name in per_module:
+            failures.append(f"{name} is imported eagerly")
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
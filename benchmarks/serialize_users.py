@@ -0,0 +1,63 @@
+"""Per-request encode time of the 100 user listing.
+
+Compares the old path (validate into schemas.User, response_model re-validation,
+jsonable_encoder + stdlib json) with serialize_user + orjson.
+
+    python -m benchmarks.serialize_users
+"""
+import argparse
+import json
+import timeit
+import uuid
+from types import SimpleNamespace
+
+from benchmarks._env import setup_env
+
+setup_env()
+
+import orjson  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from app.services.user_utils import serialize_user  # noqa: E402
+from app.sql_app import schemas  # noqa: E402
+
+
+def fake_users(count: int):
+    return [
+        SimpleNamespace(id=i, email=f"user{i}@example.com", is_active=True, confirmation=uuid.uuid4(),
+                        roles=[SimpleNamespace(role="user"), SimpleNamespace(role="admin")])
+        for i in range(count)
+    ]
+
+
+def encode_validated(users):
+    page = schemas.UserPage(users=[
+        schemas.User(id=u.id, email=u.email, is_active=u.is_active, roles=[r.role for r in u.roles])
+        for u in users
+    ], next_cursor=None)
+    # what response_model does with the handler's return value
+    page = schemas.UserPage.validate(page)
+    return json.dumps(jsonable_encoder(page)).encode()
+
+
+def encode_direct(users):
+    return orjson.dumps({
+        "users": [serialize_user(u, include_confirmation=False) for u in users],
+        "next_cursor": None,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    users = fake_users(args.users)
+    assert json.loads(encode_validated(users)) == json.loads(encode_direct(users))
+    for name, func in (("validated + json", encode_validated), ("direct + orjson", encode_direct)):
+        seconds = min(timeit.repeat(lambda: func(users), number=args.repeat, repeat=5)) / args.repeat
+        print(f"{name:>18}: {seconds * 1e6:9.1f} us per request ({args.users} users)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+# the environment is kept in alembic_env.py at the repository root
+import runpy
+from pathlib import Path
+
+runpy.run_path(str(Path(__file__).resolve().parent.parent / "alembic_env.py"))
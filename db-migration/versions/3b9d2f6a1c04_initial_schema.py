@@ -0,0 +1,54 @@
+"""initial schema, the users and roles tables of the original app
+
+Databases created before migrations were tracked already have these tables,
+mark them with `alembic stamp 3b9d2f6a1c04` instead of upgrading.
+
+Revision ID: 3b9d2f6a1c04
+Revises:
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d2f6a1c04'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('hashed_password', sa.String(), nullable=True),
+        sa.Column('confirmation', sa.CHAR(32).with_variant(postgresql.UUID(as_uuid=True), 'postgresql'),
+                  nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    op.create_index('ix_users_id', 'users', ['id'], unique=False)
+    op.create_table(
+        'roles',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('role', sa.String(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_roles_id', 'roles', ['id'], unique=False)
+    op.create_index('ix_roles_role', 'roles', ['role'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_roles_role', table_name='roles')
+    op.drop_index('ix_roles_id', table_name='roles')
+    op.drop_table('roles')
+    op.drop_index('ix_users_id', table_name='users')
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_table('users')
@@ -0,0 +1,36 @@
+"""revoked_tokens table
+
+Databases stamped at 3b9d2f6a1c04 may or may not have it already, depending on
+when create_all made them, so it is only created when missing.
+
+Revision ID: 6c2e8f1a4b90
+Revises: 3b9d2f6a1c04
+Create Date: 2026-10-18 12:42:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c2e8f1a4b90'
+down_revision = '3b9d2f6a1c04'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not op.get_context().as_sql and sa.inspect(op.get_bind()).has_table('revoked_tokens'):
+        return
+    op.create_table(
+        'revoked_tokens',
+        sa.Column('jti', sa.String(length=32), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('jti'),
+    )
+    op.create_index('ix_revoked_tokens_expires_at', 'revoked_tokens', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_revoked_tokens_expires_at', table_name='revoked_tokens')
+    op.drop_table('revoked_tokens')
@@ -0,0 +1,33 @@
+"""unique (owner_id, role) index, drop the redundant primary key indexes
+
+Revision ID: 8e41c7d05a2f
+Revises: 6c2e8f1a4b90
+Create Date: 2026-10-18 12:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e41c7d05a2f'
+down_revision = '6c2e8f1a4b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # keep the oldest of every duplicated role, the unique index can't be built otherwise
+    op.execute(sa.text(
+        "DELETE FROM roles WHERE id NOT IN (SELECT MIN(id) FROM roles GROUP BY owner_id, role)"
+    ))
+    op.create_index('ix_roles_owner_id_role', 'roles', ['owner_id', 'role'], unique=True)
+    # the primary keys are indexed already
+    op.drop_index('ix_roles_id', table_name='roles')
+    op.drop_index('ix_users_id', table_name='users')
+
+
+def downgrade():
+    op.create_index('ix_users_id', 'users', ['id'], unique=False)
+    op.create_index('ix_roles_id', 'roles', ['id'], unique=False)
+    op.drop_index('ix_roles_owner_id_role', table_name='roles')
@@ -0,0 +1,40 @@
+"""audit_events table
+
+Revision ID: a7c3e9d1f0b5
+Revises: f2d86b4a9e17
+Create Date: 2026-10-18 16:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e9d1f0b5'
+down_revision = 'f2d86b4a9e17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'audit_events',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('action', sa.String(length=64), nullable=False),
+        sa.Column('actor_id', sa.Integer(), nullable=True),
+        sa.Column('subject_id', sa.Integer(), nullable=True),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.Column('ip', sa.String(length=45), nullable=True),
+        sa.Column('detail', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_audit_events_created_at_id', 'audit_events', ['created_at', 'id'], unique=False)
+    op.create_index('ix_audit_events_subject_id_created_at_id', 'audit_events', ['subject_id', 'created_at', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_audit_events_subject_id_created_at_id', table_name='audit_events')
+    op.drop_index('ix_audit_events_created_at_id', table_name='audit_events')
+    op.drop_table('audit_events')
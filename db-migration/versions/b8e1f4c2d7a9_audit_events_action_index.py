@@ -0,0 +1,24 @@
+"""(action, created_at, id) index on audit_events, for the audit trail filtered by action
+
+Revision ID: b8e1f4c2d7a9
+Revises: d4b7a2c9e6f3
+Create Date: 2026-10-19 11:05:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e1f4c2d7a9'
+down_revision = 'd4b7a2c9e6f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_audit_events_action_created_at_id', 'audit_events', ['action', 'created_at', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_audit_events_action_created_at_id', table_name='audit_events')
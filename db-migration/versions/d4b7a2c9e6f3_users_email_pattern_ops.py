@@ -0,0 +1,31 @@
+"""ix_users_email with text_pattern_ops on postgres, for email prefix ranges
+
+Revision ID: d4b7a2c9e6f3
+Revises: a7c3e9d1f0b5
+Create Date: 2026-10-19 09:20:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b7a2c9e6f3'
+down_revision = 'a7c3e9d1f0b5'
+branch_labels = None
+depends_on = None
+
+
+# SQLite has no operator classes, its index already compares byte-wise. On postgres the drop and the
+# create run in the migration's transaction, so the unique constraint never goes missing
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_users_email', table_name='users')
+    op.create_index('ix_users_email', 'users', ['email'], unique=True, postgresql_ops={'email': 'text_pattern_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_users_email', table_name='users')
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
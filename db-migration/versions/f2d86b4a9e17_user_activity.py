@@ -0,0 +1,27 @@
+"""users.last_login_at and users.last_seen_at
+
+Revision ID: f2d86b4a9e17
+Revises: c5a8e2f71b93
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2d86b4a9e17'
+down_revision = 'c5a8e2f71b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('last_login_at', sa.DateTime(), nullable=True))
+    op.add_column('users', sa.Column('last_seen_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('last_seen_at')
+        batch_op.drop_column('last_login_at')
@@ -0,0 +1,52 @@
+"""The app running in-process on an empty database, for tests going through the HTTP API."""
+import sys
+from contextlib import asynccontextmanager
+from typing import Dict, Sequence
+
+import httpx
+
+from app.services.auth import Auth
+from app.sql_app import crud, schemas
+from app.sql_app.database import Base, SessionLocal, init_db
+
+
+def reset_singletons():
+    # the lru_cache getters of the app: caches, queues, hashers and rate limit buckets start out empty again
+    for name, module in list(sys.modules.items()):
+        if name.startswith("app.") and module is not None:
+            for value in vars(module).values():
+                if callable(getattr(value, "cache_clear", None)):
+                    value.cache_clear()
+
+
+@asynccontextmanager
+async def app_client():
+    from app.main import app
+
+    reset_singletons()
+    async with init_db().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            yield client
+    finally:
+        await app.router.shutdown()
+        reset_singletons()
+
+
+async def create_user(email: str, password: str = "password", roles: Sequence[str] = ("user",)) -> int:
+    """An activated user, straight into the database."""
+    async with SessionLocal() as db:
+        user = await crud.create_user_with_roles(db, user=schemas.UserCreate(email=email, password=password),
+                                                 hashed_password=Auth.get_password_hash(password),
+                                                 confirmation=None, roles=list(roles))
+        await crud.activate_user(db, user)
+        return user.id
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str = "password") -> Dict[str, str]:
+    response = await client.post("/auth/token", data={"username": email, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
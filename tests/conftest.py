@@ -0,0 +1,11 @@
+import os
+
+# Settings needed to import the app without a .env file, the database is a throwaway SQLite file
+os.environ.update(
+    SQLALCHEMY_DATABASE_URL="sqlite:///./test.db",
+    SECRET_KEY="test-secret",
+    SMTP_SERVER="localhost:1025",
+    APP_NAME="test",
+    # cheap hashes, the tests log in a lot
+    BCRYPT_ROUNDS="4",
+)
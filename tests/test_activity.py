@@ -0,0 +1,91 @@
+"""Last login / last seen times are buffered per user and written in batches, not per request."""
+import asyncio
+from datetime import datetime, timedelta
+
+from app.services.activity import ActivityTracker, get_activity_tracker
+from app.sql_app import crud, models
+from app.sql_app.database import SessionLocal
+from tests.app_client import app_client, create_user, login
+
+
+async def _times(user_id: int):
+    async with SessionLocal() as db:
+        user = await db.get(models.User, user_id)
+        return user.last_login_at, user.last_seen_at
+
+
+def test_requests_are_written_on_flush():
+    async def scenario():
+        async with app_client() as client:
+            user_id = await create_user("user@example.com")
+            headers = await login(client, "user@example.com")
+            for _ in range(3):
+                await client.get("/users/me", headers=headers)
+            assert await _times(user_id) == (None, None)
+            tracker = get_activity_tracker()
+            assert tracker.pending() == 2
+            await tracker.flush()
+            last_login_at, last_seen_at = await _times(user_id)
+            assert last_login_at is not None and last_seen_at >= last_login_at
+            assert tracker.snapshot()["flushed"] == 2
+
+    asyncio.run(scenario())
+
+
+def test_buffer_limit_and_early_flush():
+    async def scenario():
+        async with app_client():
+            ids = [await create_user(f"user{i}@example.com") for i in range(3)]
+            tracker = ActivityTracker(flush_interval=60, max_pending=2)
+            tracker.start()
+            tracker.seen(ids[0])
+            tracker.seen(ids[0])
+            tracker.seen(ids[1])
+            # full: a new user is dropped, the others are written without waiting for the interval
+            tracker.seen(ids[2])
+            await asyncio.sleep(0.2)
+            snapshot = tracker.snapshot()
+            await tracker.stop()
+            return snapshot, [await _times(user_id) for user_id in ids]
+
+    snapshot, times = asyncio.run(scenario())
+    assert snapshot == {"pending": 0, "dropped": 1, "flushed": 2, "flush_errors": 0}
+    assert [last_seen_at is not None for _, last_seen_at in times] == [True, True, False]
+
+
+def test_failed_flush_is_retried(monkeypatch):
+    update_activity = crud.update_activity
+
+    async def fail(db, logins, seen):
+        raise RuntimeError("database down")
+
+    async def scenario():
+        async with app_client():
+            user_id = await create_user("user@example.com")
+            tracker = ActivityTracker(flush_interval=60, max_pending=10)
+            tracker.login(user_id)
+            monkeypatch.setattr(crud, "update_activity", fail)
+            # stop() flushes what is left, here without success
+            await tracker.stop()
+            assert (tracker.flush_errors, tracker.pending()) == (1, 2)
+            monkeypatch.setattr(crud, "update_activity", update_activity)
+            await tracker.stop()
+            assert tracker.pending() == 0
+            return await _times(user_id)
+
+    assert None not in asyncio.run(scenario())
+
+
+def test_older_times_dont_replace_newer_ones():
+    async def scenario():
+        async with app_client():
+            user_id = await create_user("user@example.com")
+            now = datetime.utcnow()
+            async with SessionLocal() as db:
+                await crud.update_activity(db, logins={user_id: now}, seen={user_id: now})
+                # another worker flushing its older buffer later
+                await crud.update_activity(db, logins={user_id: now - timedelta(minutes=5)}, seen={})
+            return now, await _times(user_id)
+
+    now, (last_login_at, last_seen_at) = asyncio.run(scenario())
+    assert last_login_at == last_seen_at == now
@@ -0,0 +1,106 @@
+"""The audit log queues events for a background writer and accounts for every event it can't write."""
+import asyncio
+
+from app.services.audit import AuditLog, get_audit_log
+from app.services.mailer import Mailer
+from tests.app_client import app_client, create_user, login
+
+
+class MemoryAuditLog(AuditLog):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    async def _write(self, batch):
+        self.batches.append(batch)
+        self.written += len(batch)
+
+
+class StuckAuditLog(AuditLog):
+    # a database that never answers
+    async def _write(self, batch):
+        await asyncio.Event().wait()
+
+
+def test_stop_writes_queued_events():
+    async def scenario():
+        audit_log = MemoryAuditLog(maxsize=100, batch_size=2, overflow_policy="drop", block_timeout=1)
+        audit_log.start()
+        for i in range(5):
+            await audit_log.record("user.updated", subject_id=i)
+        await audit_log.stop(timeout=1)
+        return audit_log
+
+    audit_log = asyncio.run(scenario())
+    assert audit_log.written == 5
+    assert all(len(batch) <= 2 for batch in audit_log.batches)
+    assert audit_log.dropped == 0
+
+
+def test_full_queue_drops():
+    async def scenario():
+        audit_log = MemoryAuditLog(maxsize=2, batch_size=10, overflow_policy="drop", block_timeout=1)
+        audit_log.start()
+        # the writer doesn't get to run in between
+        for i in range(5):
+            await audit_log.record("auth.login_failed", email=f"user{i}@example.com")
+        await audit_log.stop(timeout=1)
+        return audit_log
+
+    audit_log = asyncio.run(scenario())
+    assert (audit_log.written, audit_log.dropped) == (2, 3)
+
+
+def test_stop_with_a_stuck_writer():
+    async def scenario():
+        audit_log = StuckAuditLog(maxsize=100, batch_size=2, overflow_policy="drop", block_timeout=1)
+        audit_log.start()
+        for i in range(5):
+            await audit_log.record("user.updated", subject_id=i)
+        # the worker takes the first batch and hangs on it
+        await asyncio.sleep(0)
+        await audit_log.stop(timeout=0.05)
+        await audit_log.record("user.updated", subject_id=99)
+        return audit_log
+
+    audit_log = asyncio.run(scenario())
+    # the batch being written, the queued events and the one recorded after stop
+    assert audit_log.dropped == 6
+    assert audit_log.written == 0
+    assert audit_log.snapshot()["queued"] == 0
+
+
+async def _wait_written(count: int):
+    audit_log = get_audit_log()
+    for _ in range(100):
+        if audit_log.snapshot()["written"] >= count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{audit_log.snapshot()} after 1s")
+
+
+def test_api_actions_are_audited(monkeypatch):
+    monkeypatch.setattr(Mailer, "send_message", staticmethod(lambda content, subject, mail_to: None))
+
+    async def scenario():
+        async with app_client() as client:
+            admin_id = await create_user("admin@example.com", roles=["admin"])
+            admin = await login(client, "admin@example.com")
+            user_id = (await client.post("/users/", json={"email": "new@example.com", "password": "p"})).json()["id"]
+            await client.post("/auth/token", data={"username": "new@example.com", "password": "wrong"})
+            await client.post("/roles/", headers=admin, json={"owner_id": user_id, "role": "editor"})
+            await client.put("/users/me", headers=admin, json={"email": "boss@example.com"})
+            await _wait_written(4)
+            # the admin's token named the old email, log in again
+            admin = await login(client, "boss@example.com")
+            return admin_id, user_id, (await client.get("/audit/", headers=admin)).json()["events"]
+
+    admin_id, user_id, events = asyncio.run(scenario())
+    assert [(event["action"], event["actor_id"], event["subject_id"]) for event in events] == [
+        ("user.update", admin_id, admin_id),
+        ("role.create", admin_id, user_id),
+        ("auth.login_failed", None, None),
+        ("user.register", None, user_id),
+    ]
+    assert events[0]["detail"] == {"changes": {"email": "boss@example.com"}}
+    assert (events[2]["email"], events[2]["ip"]) == ("new@example.com", "127.0.0.1")
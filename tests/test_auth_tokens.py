@@ -0,0 +1,86 @@
+"""Email confirmation and password reset with the tokens sent by email, and other tokens refused there."""
+import asyncio
+
+import pytest
+
+from app.services.audit import get_audit_log
+from app.services.auth import get_principal_cache
+from app.services.mailer import Mailer
+from app.sql_app import crud
+from app.sql_app.database import SessionLocal
+from tests.app_client import app_client, create_user, login
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    sent = []
+    monkeypatch.setattr(Mailer, "send_message", staticmethod(lambda content, subject, mail_to: sent.append(content)))
+    return sent
+
+
+def _token(content: str, path: str) -> str:
+    # the link is the last word of the email
+    url = content.split()[-1].rstrip(".")
+    assert f"/auth/{path}/" in url
+    return url.rsplit("/", 1)[1]
+
+
+def test_reset_password(outbox):
+    async def scenario():
+        async with app_client() as client:
+            user_id = await create_user("reset@example.com", "old-password")
+            headers = await login(client, "reset@example.com", "old-password")
+            assert (await client.get("/users/me", headers=headers)).status_code == 200
+            async with SessionLocal() as db:
+                version = await crud.get_user_version(db, user_id=user_id)
+
+            response = await client.post("/auth/forgot_password", json={"email": "reset@example.com"})
+            assert response.status_code == 200
+            token = _token(outbox[-1], "reset_password")
+            response = await client.post(f"/auth/reset_password/{token}", json={"password": "new-password"})
+            assert response.status_code == 200, response.text
+
+            # the principal cached for the old session is gone, the version went up
+            assert not get_principal_cache()._keys_by_user.get(user_id)
+            async with SessionLocal() as db:
+                assert await crud.get_user_version(db, user_id=user_id) == version + 1
+            response = await client.post("/auth/token", data={"username": "reset@example.com",
+                                                               "password": "old-password"})
+            assert response.status_code == 401
+            await login(client, "reset@example.com", "new-password")
+
+            await get_audit_log().stop()
+            async with SessionLocal() as db:
+                events = await crud.get_audit_events(db, action="user.reset_password")
+            assert [event.subject_id for event in events] == [user_id]
+
+    asyncio.run(scenario())
+
+
+def test_verify_email(outbox):
+    async def scenario():
+        async with app_client() as client:
+            response = await client.post("/users/", json={"email": "new@example.com", "password": "password"})
+            assert response.status_code == 200
+            assert response.json()["is_active"] is False
+            token = _token(outbox[-1], "activate_email")
+            response = await client.get(f"/auth/activate_email/{token}")
+            assert response.status_code == 200, response.text
+            assert response.json()["is_active"] is True
+            # used up
+            assert (await client.get(f"/auth/activate_email/{token}")).status_code == 400
+
+    asyncio.run(scenario())
+
+
+def test_access_token_is_not_an_email_token():
+    async def scenario():
+        async with app_client() as client:
+            await create_user("someone@example.com")
+            token = (await login(client, "someone@example.com"))["Authorization"].split()[1]
+            response = await client.post(f"/auth/reset_password/{token}", json={"password": "new-password"})
+            assert response.status_code == 400
+            response = await client.get(f"/auth/activate_email/{token}")
+            assert response.status_code == 400
+
+    asyncio.run(scenario())
@@ -0,0 +1,82 @@
+"""Bulk imports report a result per line and insert the valid rows."""
+import asyncio
+
+import orjson
+
+from tests.app_client import app_client, create_user, login
+
+
+async def _import(client, url: str, headers, filename: str, content: bytes, content_type: str):
+    response = await client.post(url, headers=headers, files={"file": (filename, content, content_type)})
+    assert response.status_code == 200, response.text
+    *results, summary = [orjson.loads(line) for line in response.content.splitlines()]
+    return {result["line"]: result for result in results}, summary
+
+
+def test_import_users():
+    ndjson = b"\n".join([
+        b'{"email": "one@example.com", "password": "password"}',
+        b'{"email": "not-an-email", "password": "password"}',
+        b'{"email": "one@example.com", "password": "again"}',
+        b'{"email": "admin@example.com", "password": "password"}',
+        b'{"email": ',
+        b'"just a string"',
+        b'{"email": "two@example.com", "password": "p\xff"}',
+        b'',
+        b'{"email": "three@example.com", "password": "password", "is_active": false}',
+    ]) + b"\n"
+
+    async def scenario():
+        async with app_client() as client:
+            await create_user("admin@example.com", roles=["admin"])
+            admin = await login(client, "admin@example.com")
+            results, summary = await _import(client, "/users/bulk", admin, "users.ndjson", ndjson,
+                                             "application/x-ndjson")
+            assert {line: result["status"] for line, result in results.items()} == {
+                1: "created", 2: "error", 3: "error", 4: "error", 5: "error", 6: "error", 7: "error", 9: "created"}
+            assert results[3]["detail"] == results[4]["detail"] == "Email already registered"
+            assert results[7]["detail"].startswith("Malformed row")
+            assert summary == {"created": 2, "failed": 6}
+            # imported users can log in with their password right away
+            await login(client, "one@example.com")
+
+    asyncio.run(scenario())
+
+
+def test_import_users_csv():
+    async def scenario():
+        async with app_client() as client:
+            await create_user("admin@example.com", roles=["admin"])
+            admin = await login(client, "admin@example.com")
+            content = b"email,password,is_active\r\none@example.com,password,true\r\ntwo@example.com\r\n"
+            results, summary = await _import(client, "/users/bulk", admin, "users.csv", content, "text/csv")
+            assert (results[2]["status"], results[3]["status"]) == ("created", "error")
+            assert summary == {"created": 1, "failed": 1}
+
+            results, summary = await _import(client, "/users/bulk", admin, "users.csv", b"\xff\xfe\n", "text/csv")
+            assert results[1]["detail"].startswith("Malformed header")
+
+    asyncio.run(scenario())
+
+
+def test_import_roles():
+    async def scenario():
+        async with app_client() as client:
+            admin_id = await create_user("admin@example.com", roles=["admin"])
+            user_id = await create_user("user@example.com")
+            admin = await login(client, "admin@example.com")
+            user = await login(client, "user@example.com")
+            assert (await client.post("/roles/bulk", headers=user, files={
+                "file": ("roles.csv", b"owner_id,role\n", "text/csv")})).status_code == 403
+            # caches the user's roles
+            assert (await client.get("/users/me", headers=user)).json()["roles"] == ["user"]
+
+            content = f"owner_id,role\n{user_id},editor\n{user_id},editor\n{admin_id},admin\n999,editor\n".encode()
+            results, summary = await _import(client, "/roles/bulk", admin, "roles.csv", content, "text/csv")
+            assert results[2]["status"] == "created"
+            assert results[3]["detail"] == results[4]["detail"] == "Role already assigned"
+            assert results[5]["detail"] == "User not found"
+            assert summary == {"created": 1, "failed": 3}
+            assert sorted((await client.get("/users/me", headers=user)).json()["roles"]) == ["editor", "user"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,72 @@
+"""Users with their roles are loaded in a fixed number of statements, whatever the page size."""
+import asyncio
+
+import pytest
+from sqlalchemy import event, insert
+
+from app.services.user_utils import get_all_users_response
+from app.sql_app import crud, models
+from app.sql_app.database import Base, SessionLocal, dispose_db, init_db
+
+
+async def _seed(users: int):
+    async with init_db().begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(insert(models.User), [
+            {"id": i, "email": f"user{i}@example.com", "hashed_password": "x", "is_active": True}
+            for i in range(1, users + 1)
+        ])
+        await conn.execute(insert(models.Role), [
+            {"owner_id": i, "role": role} for i in range(1, users + 1) for role in ("user", "editor")
+        ])
+
+
+async def _count_statements(call) -> int:
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    sync_engine = init_db().sync_engine
+    event.listen(sync_engine, "before_cursor_execute", count)
+    try:
+        async with SessionLocal() as db:
+            await call(db)
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", count)
+    return len(statements)
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    asyncio.run(_seed(200))
+    yield
+    asyncio.run(dispose_db())
+
+
+@pytest.mark.parametrize("limit", [1, 10, 150])
+def test_users_with_roles_page(seeded, limit):
+    async def call(db):
+        users = await crud.get_users_with_roles(db, limit=limit)
+        assert len(users) == limit
+        assert all(sorted(r.role for r in user.roles) == ["editor", "user"] for user in users)
+
+    # the users, then the roles of the whole page in one SELECT ... IN
+    assert asyncio.run(_count_statements(call)) == 2
+
+
+@pytest.mark.parametrize("limit", [1, 100])
+def test_users_listing_response(seeded, limit):
+    async def call(db):
+        await get_all_users_response(db, cursor=None, limit=limit)
+
+    assert asyncio.run(_count_statements(call)) == 2
+
+
+def test_user_with_roles(seeded):
+    async def call(db):
+        user = await crud.get_user_with_roles(db, user_id=42)
+        assert len(user.roles) == 2
+
+    assert asyncio.run(_count_statements(call)) == 2
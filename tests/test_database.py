@@ -0,0 +1,37 @@
+"""The async engine setup and the connection pool warm-up."""
+import asyncio
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.sql_app import database
+
+
+@pytest.mark.parametrize("connections", [0, 1, 3])
+def test_warm_pool_opens_the_connections(monkeypatch, connections):
+    async def scenario():
+        engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=AsyncAdaptedQueuePool, pool_size=5)
+        opened = []
+        event.listen(engine.sync_engine, "connect", lambda *args: opened.append(args))
+        monkeypatch.setattr(database, "engine", engine)
+        try:
+            await database.warm_pool(connections)
+            return len(opened), engine.sync_engine.pool.checkedin()
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(scenario()) == (connections, connections)
+
+
+@pytest.mark.parametrize("url, async_url", [
+    ("postgresql://user:pass@db/app", "postgresql+asyncpg://user:pass@db/app"),
+    ("postgres://user:pass@db/app", "postgresql+asyncpg://user:pass@db/app"),
+    ("postgresql+psycopg2://user:pass@db/app", "postgresql+asyncpg://user:pass@db/app"),
+    ("sqlite:///./app.db", "sqlite+aiosqlite:///./app.db"),
+    # already async
+    ("postgresql+asyncpg://user:pass@db/app", "postgresql+asyncpg://user:pass@db/app"),
+])
+def test_async_database_url(url, async_url):
+    assert str(database.get_async_database_url(url)) == async_url
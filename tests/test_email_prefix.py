@@ -0,0 +1,36 @@
+"""The email prefix filter of the user list is a range on the email index."""
+import pytest
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.sql_app.crud import _email_prefix_filter, _prefix_upper_bound
+
+
+@pytest.mark.parametrize("prefix, upper_bound", [
+    ("abc", "abd"),
+    ("a@", "aA"),
+    # past the last code point the previous character goes up instead
+    ("z\U0010ffff", "{"),
+    ("\U0010ffff", None),
+    # surrogates can't be encoded, they are skipped
+    ("a\ud7ff", "a\ue000"),
+])
+def test_prefix_upper_bound(prefix, upper_bound):
+    assert _prefix_upper_bound(prefix) == upper_bound
+
+
+@pytest.mark.parametrize("email, matches", [
+    ("bench4@example.com", True),
+    ("bench4", True),
+    ("bench49@example.org", True),
+    ("bench3zzz@example.com", False),
+    ("bench5@example.com", False),
+])
+def test_range_is_the_prefix(email, matches):
+    assert ("bench4" <= email < _prefix_upper_bound("bench4")) == email.startswith("bench4") == matches
+
+
+def test_operators_per_dialect():
+    pg = str(_email_prefix_filter("postgresql", "ab").compile(dialect=postgresql.dialect()))
+    assert "~>=~" in pg and "~<~" in pg
+    lite = str(_email_prefix_filter("sqlite", "ab").compile(dialect=sqlite.dialect()))
+    assert ">=" in lite and "<" in lite and "LIKE" not in lite
@@ -0,0 +1,85 @@
+"""User resources carry an ETag, a matching If-None-Match gets a 304 until the user changes."""
+import asyncio
+
+import pytest
+
+from app.services.user_utils import etag_matches
+from app.sql_app import crud
+from tests.app_client import app_client, create_user, login
+
+
+@pytest.mark.parametrize("if_none_match, matches", [
+    (None, False),
+    ('"1-2"', True),
+    ('W/"1-2"', True),
+    ('"1-1", "1-2"', True),
+    ("*", True),
+    ('"1-1"', False),
+    ("1-2", False),
+])
+def test_etag_matches(if_none_match, matches):
+    assert etag_matches(if_none_match, '"1-2"') == matches
+
+
+def test_user_etag():
+    async def scenario():
+        async with app_client() as client:
+            await create_user("admin@example.com", roles=["admin"])
+            user_id = await create_user("user@example.com")
+            admin = await login(client, "admin@example.com")
+            user = await login(client, "user@example.com")
+
+            response = await client.get(f"/users/{user_id}", headers=admin)
+            etag = response.headers["etag"]
+            assert response.json()["email"] == "user@example.com"
+            response = await client.get(f"/users/{user_id}", headers={**admin, "If-None-Match": etag})
+            assert (response.status_code, response.content, response.headers["etag"]) == (304, b"", etag)
+
+            response = await client.put("/users/me", headers=user, json={"email": "renamed@example.com"})
+            assert response.headers["etag"] != etag
+            response = await client.get(f"/users/{user_id}", headers={**admin, "If-None-Match": etag})
+            assert response.status_code == 200 and response.json()["email"] == "renamed@example.com"
+            assert (await client.get("/users/999", headers=admin)).status_code == 404
+
+    asyncio.run(scenario())
+
+
+def test_me_etag():
+    async def scenario():
+        async with app_client() as client:
+            await create_user("admin@example.com", roles=["admin"])
+            user_id = await create_user("user@example.com")
+            admin = await login(client, "admin@example.com")
+            user = await login(client, "user@example.com")
+            etag = (await client.get("/users/me", headers=user)).headers["etag"]
+            assert (await client.get("/users/me", headers={**user, "If-None-Match": etag})).status_code == 304
+            await client.post("/roles/", headers=admin, json={"owner_id": user_id, "role": "editor"})
+            response = await client.get("/users/me", headers={**user, "If-None-Match": etag})
+            assert response.status_code == 200 and sorted(response.json()["roles"]) == ["editor", "user"]
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_misses_load_once(monkeypatch):
+    loads = []
+    get_user_with_roles = crud.get_user_with_roles
+
+    async def counted(db, user_id):
+        loads.append(user_id)
+        return await get_user_with_roles(db, user_id=user_id)
+
+    monkeypatch.setattr(crud, "get_user_with_roles", counted)
+
+    async def scenario():
+        async with app_client() as client:
+            await create_user("admin@example.com", roles=["admin"])
+            user_id = await create_user("user@example.com")
+            admin = await login(client, "admin@example.com")
+            loads.clear()
+            responses = await asyncio.gather(*(client.get(f"/users/{user_id}", headers=admin) for _ in range(5)))
+            assert {response.status_code for response in responses} == {200}
+            # cached afterwards
+            await client.get(f"/users/{user_id}", headers=admin)
+
+    asyncio.run(scenario())
+    assert loads == [2]
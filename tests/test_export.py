@@ -0,0 +1,61 @@
+"""The user directory export streams every user with its roles, as NDJSON or CSV."""
+import asyncio
+import csv
+import io
+
+import orjson
+
+from app.services.user_utils import export_users
+from app.sql_app.database import SessionLocal
+from tests.app_client import app_client, create_user, login
+
+
+async def _seed():
+    await create_user("admin@example.com", roles=["admin", "user"])
+    await create_user("comma@example.com", roles=["sales, north", 'quote"d'])
+    await create_user("nobody@example.com", roles=[])
+    for i in range(3):
+        await create_user(f"user{i}@example.com")
+
+
+EXPECTED = [
+    (1, "admin@example.com", ["admin", "user"]),
+    (2, "comma@example.com", ['quote"d', "sales, north"]),
+    (3, "nobody@example.com", []),
+    (4, "user0@example.com", ["user"]),
+    (5, "user1@example.com", ["user"]),
+    (6, "user2@example.com", ["user"]),
+]
+
+
+def test_export_ndjson_and_csv():
+    async def scenario():
+        async with app_client() as client:
+            await _seed()
+            admin = await login(client, "admin@example.com")
+            response = await client.get("/users/export", headers=admin)
+            assert response.status_code == 200
+            assert response.headers["content-type"] == "application/x-ndjson"
+            users = [orjson.loads(line) for line in response.content.splitlines()]
+            assert [(user["id"], user["email"], user["roles"]) for user in users] == EXPECTED
+            assert all(user["is_active"] for user in users)
+
+            response = await client.get("/users/export?format=csv", headers=admin)
+            assert response.headers["content-disposition"] == "attachment; filename=users.csv"
+            rows = list(csv.DictReader(io.StringIO(response.text)))
+            assert [(int(row["id"]), row["email"], orjson.loads(row["roles"])) for row in rows] == EXPECTED
+
+            assert (await client.get("/users/export?format=xml", headers=admin)).status_code == 422
+
+    asyncio.run(scenario())
+
+
+def test_export_in_batches():
+    async def scenario():
+        async with app_client():
+            await _seed()
+            async with SessionLocal() as db:
+                return [chunk async for chunk in export_users(db, export_format="ndjson", batch_size=4)]
+
+    chunks = asyncio.run(scenario())
+    assert [len(chunk.splitlines()) for chunk in chunks] == [4, 2]
@@ -0,0 +1,19 @@
+"""Importing the app builds nothing from the settings, so scripts and tools can import it without a .env file."""
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_import_without_settings(tmp_path):
+    env = {key: value for key, value in os.environ.items()
+           if key not in ("SQLALCHEMY_DATABASE_URL", "SECRET_KEY", "SMTP_SERVER", "APP_NAME")}
+    env["PYTHONPATH"] = str(ROOT)
+    # a directory without a .env file
+    result = subprocess.run(
+        [sys.executable, "-c", "import app.main, app.cli, app.services.auth, app.services.bulk"],
+        cwd=tmp_path, env=env, capture_output=True, text=True,
+    )
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,107 @@
+"""The mail queue sends in the background over one connection, retries transient failures and stops cleanly."""
+import asyncio
+import threading
+from email.message import EmailMessage
+from smtplib import SMTPResponseException
+
+from app.services.mailer import MailQueue
+
+
+def _message(to: str) -> EmailMessage:
+    message = EmailMessage()
+    message.set_content("Hi!")
+    message["To"] = to
+    return message
+
+
+class FakeSMTP:
+    def __init__(self, failures=None, release: threading.Event = None):
+        # recipient -> SMTP codes to answer with, one per attempt
+        self.failures = failures or {}
+        self.release = release
+        self.sent = []
+        self.connections = 0
+
+    def send_message(self, message):
+        if self.release is not None:
+            self.release.wait(1)
+        codes = self.failures.get(message["To"])
+        if codes:
+            raise SMTPResponseException(codes.pop(0), b"try again")
+        self.sent.append(message["To"])
+
+    def quit(self):
+        pass
+
+
+class FakeMailQueue(MailQueue):
+    def __init__(self, smtp: FakeSMTP, **kwargs):
+        options = dict(maxsize=100, batch_size=10, max_retries=2, retry_backoff=0.01, idle_timeout=60)
+        options.update(kwargs)
+        super().__init__(**options)
+        self.smtp = smtp
+
+    def _connection(self):
+        if self._smtp is None:
+            self.smtp.connections += 1
+            self._smtp = self.smtp
+        return self._smtp
+
+
+def test_sends_over_one_connection():
+    smtp = FakeSMTP()
+
+    async def scenario():
+        mail_queue = FakeMailQueue(smtp)
+        mail_queue.start()
+        for i in range(5):
+            mail_queue.enqueue(_message(f"user{i}@example.com"))
+        await mail_queue.stop(timeout=1)
+        return mail_queue
+
+    mail_queue = asyncio.run(scenario())
+    assert smtp.sent == [f"user{i}@example.com" for i in range(5)]
+    assert smtp.connections == 1
+    assert mail_queue.dropped == 0
+
+
+def test_retries_transient_failures_only():
+    smtp = FakeSMTP(failures={"busy@example.com": [451], "gone@example.com": [550], "down@example.com": [451] * 5})
+
+    async def scenario():
+        mail_queue = FakeMailQueue(smtp)
+        mail_queue.start()
+        for to in ("busy@example.com", "gone@example.com", "down@example.com", "ok@example.com"):
+            mail_queue.enqueue(_message(to))
+        # backoffs of 10, 20 and 40ms
+        await asyncio.sleep(0.3)
+        await mail_queue.stop(timeout=1)
+        return mail_queue
+
+    mail_queue = asyncio.run(scenario())
+    assert sorted(smtp.sent) == ["busy@example.com", "ok@example.com"]
+    # down@ gave up after max_retries, gone@ was rejected for good
+    assert mail_queue.dropped == 1
+
+
+def test_stop_with_a_hanging_server():
+    release = threading.Event()
+    smtp = FakeSMTP(release=release)
+
+    async def scenario():
+        mail_queue = FakeMailQueue(smtp, batch_size=2)
+        mail_queue.start()
+        for i in range(5):
+            mail_queue.enqueue(_message(f"user{i}@example.com"))
+        await asyncio.sleep(0.01)
+        stopping = asyncio.get_running_loop().create_task(mail_queue.stop(timeout=0.05))
+        await asyncio.sleep(0.1)
+        release.set()
+        await stopping
+        mail_queue.enqueue(_message("late@example.com"))
+        return mail_queue
+
+    mail_queue = asyncio.run(scenario())
+    # the batch of two being sent, the three queued emails and the one enqueued after stop
+    assert mail_queue.dropped == 6
+    assert mail_queue.snapshot()["size"] == 0
@@ -0,0 +1,59 @@
+"""Every response carries a Server-Timing header, /metrics exports the per-route histograms when enabled."""
+import asyncio
+
+from app.services.metrics import Histogram
+from tests.app_client import app_client, create_user, login
+
+
+def test_server_timing_header():
+    async def scenario():
+        async with app_client() as client:
+            await create_user("user@example.com")
+            headers = await login(client, "user@example.com")
+            response = await client.get("/users/me", headers=headers)
+            timing = response.headers["server-timing"]
+            assert timing.startswith("app;dur=") and "db;dur=" in timing
+            # errors are timed too
+            assert "server-timing" in (await client.get("/users/me")).headers
+
+    asyncio.run(scenario())
+
+
+def test_metrics_disabled_by_default():
+    async def scenario():
+        async with app_client() as client:
+            assert (await client.get("/metrics")).status_code == 404
+
+    asyncio.run(scenario())
+
+
+def test_metrics_with_a_token(monkeypatch):
+    monkeypatch.setenv("METRICS_ENABLED", "true")
+    monkeypatch.setenv("METRICS_TOKEN", "scrape")
+
+    async def scenario():
+        async with app_client() as client:
+            await client.get("/users/1")
+            assert (await client.get("/metrics")).status_code == 401
+            assert (await client.get("/metrics", headers={"Authorization": "Bearer wrong"})).status_code == 401
+            response = await client.get("/metrics", headers={"Authorization": "Bearer scrape"})
+            assert response.status_code == 200
+            return response.text
+
+    text = asyncio.run(scenario())
+    # labelled with the route template, not the requested path
+    assert 'http_request_duration_seconds_count{method="GET",route="/users/{user_id}",status="401"}' in text
+    assert "http_request_db_statements_bucket" in text
+    assert "\nmail_queue_" in text and "\napp_startup_seconds " in text
+
+
+def test_histogram_buckets():
+    histogram = Histogram("latency", "Latency", ("route",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value, "/a")
+    lines = histogram.render()
+    assert 'latency_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'latency_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'latency_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'latency_sum{route="/a"} 5.65' in lines
+    assert 'latency_count{route="/a"} 4' in lines
@@ -0,0 +1,67 @@
+"""Keyset pagination of the user list and the audit trail."""
+import asyncio
+from datetime import datetime, timedelta
+
+from app.sql_app import crud
+from app.sql_app.database import SessionLocal
+from tests.app_client import app_client, create_user, login
+
+
+async def _pages(client, url: str, headers, items: str):
+    pages, cursor = [], None
+    while True:
+        response = await client.get(url + (f"&cursor={cursor}" if cursor else ""), headers=headers)
+        assert response.status_code == 200, response.text
+        pages.append(response.json()[items])
+        cursor = response.json()["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_users_pages():
+    async def scenario():
+        async with app_client() as client:
+            await create_user("admin@example.com", roles=["admin"])
+            for i in range(6):
+                await create_user(f"user{i}@example.com")
+            admin = await login(client, "admin@example.com")
+            pages = await _pages(client, "/users/?limit=3", admin, "users")
+            assert [len(page) for page in pages] == [3, 3, 1]
+            ids = [user["id"] for page in pages for user in page]
+            assert ids == sorted(ids) and len(set(ids)) == 7
+
+            pages = await _pages(client, "/users/?limit=2&email=user", admin, "users")
+            assert [user["email"] for page in pages for user in page] == [f"user{i}@example.com" for i in range(6)]
+
+            for cursor in ("not-a-cursor", "LTE", "MXwy"):  # garbage, -1 and "1|2"
+                response = await client.get(f"/users/?cursor={cursor}", headers=admin)
+                assert response.status_code == 400
+
+    asyncio.run(scenario())
+
+
+def test_audit_events_pages():
+    async def scenario():
+        async with app_client() as client:
+            user_id = await create_user("admin@example.com", roles=["admin"])
+            admin = await login(client, "admin@example.com")
+            started = datetime(2026, 1, 1)
+            async with SessionLocal() as db:
+                # two events per second, the cursor has to tell them apart by id
+                await crud.create_audit_events(db, [
+                    {"created_at": started + timedelta(seconds=i // 2), "action": ("role.create", "user.update")[i % 2],
+                     "actor_id": user_id, "subject_id": user_id, "email": None, "ip": None, "detail": None}
+                    for i in range(7)
+                ])
+            pages = await _pages(client, "/audit/?limit=3", admin, "events")
+            events = [event for page in pages for event in page]
+            assert [len(page) for page in pages] == [3, 3, 1]
+            # newest first, events of the same second ordered by id
+            assert [(event["created_at"], event["id"]) for event in events] == \
+                sorted(((event["created_at"], event["id"]) for event in events), reverse=True)
+
+            pages = await _pages(client, "/audit/?limit=2&action=user.update", admin, "events")
+            assert [len(page) for page in pages] == [2, 1]
+            assert (await client.get("/audit/?cursor=MQ", headers=admin)).status_code == 400
+
+    asyncio.run(scenario())
@@ -0,0 +1,52 @@
+"""Password hashing runs on a bounded pool and refuses work beyond it instead of queueing."""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.auth import PasswordHasher
+
+
+def test_hash_and_verify():
+    async def scenario():
+        hasher = PasswordHasher(executor="thread", workers=2, max_queue=2)
+        try:
+            hashed_password = await hasher.hash("secret")
+            return hashed_password, await hasher.verify("secret", hashed_password), \
+                await hasher.verify("wrong", hashed_password), hasher.metrics.snapshot()
+        finally:
+            hasher.shutdown()
+
+    hashed_password, valid, invalid, metrics = asyncio.run(scenario())
+    assert hashed_password.startswith("$2b$")
+    assert (valid, invalid) == (True, False)
+    assert (metrics["completed"], metrics["in_flight"]) == (3, 0)
+
+
+def test_rejects_beyond_workers_and_queue():
+    async def scenario():
+        hasher = PasswordHasher(executor="thread", workers=1, max_queue=1)
+        try:
+            return await asyncio.gather(*(hasher.hash(f"secret{i}") for i in range(3)),
+                                        return_exceptions=True), hasher.metrics.snapshot()
+        finally:
+            hasher.shutdown()
+
+    results, metrics = asyncio.run(scenario())
+    rejected = [result for result in results if isinstance(result, HTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503
+    assert rejected[0].headers["Retry-After"] == "1"
+    assert (metrics["completed"], metrics["rejected"]) == (2, 1)
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_executors(executor):
+    async def scenario():
+        hasher = PasswordHasher(executor=executor, workers=1, max_queue=4)
+        try:
+            return await hasher.verify("secret", await hasher.hash("secret"))
+        finally:
+            hasher.shutdown()
+
+    assert asyncio.run(scenario())
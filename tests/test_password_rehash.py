@@ -0,0 +1,56 @@
+"""A login replaces a hash made with an outdated scheme or cost by one with the current settings."""
+import asyncio
+
+import pytest
+from passlib.hash import bcrypt
+from sqlalchemy import select, update
+
+from app.services.auth import Auth
+from app.sql_app import crud, models
+from app.sql_app.database import SessionLocal
+from tests.app_client import app_client, create_user, login
+
+
+async def _set_hash(user_id: int, hashed_password: str):
+    async with SessionLocal() as db:
+        await db.execute(update(models.User).where(models.User.id == user_id).values(hashed_password=hashed_password))
+        await db.commit()
+
+
+async def _get_hash(user_id: int) -> str:
+    async with SessionLocal() as db:
+        return (await db.execute(select(models.User.hashed_password).filter(models.User.id == user_id))).scalar()
+
+
+@pytest.mark.parametrize("schemes, prefix", [('["bcrypt"]', "$2b$04$"), ('["argon2", "bcrypt"]', "$argon2id$")])
+def test_login_upgrades_the_hash(monkeypatch, schemes, prefix):
+    monkeypatch.setenv("PASSWORD_SCHEMES", schemes)
+
+    async def scenario():
+        async with app_client() as client:
+            user_id = await create_user("user@example.com")
+            # made before the cost was lowered to the tests' 4 rounds
+            await _set_hash(user_id, bcrypt.using(rounds=5).hash("password"))
+            await login(client, "user@example.com")
+            upgraded = await _get_hash(user_id)
+            assert upgraded.startswith(prefix) and not Auth.needs_rehash(upgraded)
+            # and the password still works, without another rehash
+            await login(client, "user@example.com")
+            assert await _get_hash(user_id) == upgraded
+            response = await client.post("/auth/token", data={"username": "user@example.com", "password": "wrong"})
+            assert response.status_code == 401
+
+    asyncio.run(scenario())
+
+
+def test_rehash_doesnt_overwrite_a_new_password():
+    async def scenario():
+        async with app_client():
+            user_id = await create_user("user@example.com")
+            old_hash = bcrypt.using(rounds=5).hash("password")
+            # the password was reset while the rehash of the old one was running
+            async with SessionLocal() as db:
+                await crud.update_password_hash(db, user_id=user_id, old_hash=old_hash, new_hash="rehashed")
+            return await _get_hash(user_id)
+
+    assert asyncio.run(scenario()).startswith("$2b$04$")
@@ -0,0 +1,78 @@
+"""Verified tokens are served from the principal cache until the token expires or its user changes."""
+import asyncio
+import re
+import time
+
+from app.services import cache
+from app.services.auth import PrincipalCache
+from app.sql_app.schemas import User
+from tests.app_client import app_client, create_user, login
+
+
+def _principal(user_id: int) -> User:
+    return User.construct(id=user_id, email=f"user{user_id}@example.com", is_active=True, confirmation=None,
+                          roles=["user"])
+
+
+class Clock:
+    now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def test_ttl_and_lru(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    ttl_cache = cache.TTLCache(maxsize=2, ttl=10)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    assert ttl_cache.get("a") == 1
+    # "b" is the least recently used
+    ttl_cache.set("c", 3)
+    assert (ttl_cache.get("a"), ttl_cache.get("b"), ttl_cache.get("c")) == (1, None, 3)
+    clock.now += 10
+    assert ttl_cache.get("a") is None
+    assert not ttl_cache.set("d", 4, ttl=0)
+
+
+def test_invalidate_user_drops_all_its_tokens():
+    principal_cache = PrincipalCache(maxsize=10, ttl=60)
+    for token, user_id in (("t1", 1), ("t2", 1), ("t3", 2)):
+        principal_cache.add(token, _principal(user_id), jti=token)
+    principal_cache.invalidate_user(1)
+    assert principal_cache.lookup("t1") is None and principal_cache.lookup("t2") is None
+    assert principal_cache.lookup("t3")[1] == "t3"
+    assert set(principal_cache._keys_by_user) == {2}
+
+
+def test_index_follows_evictions():
+    principal_cache = PrincipalCache(maxsize=2, ttl=60)
+    for token, user_id in (("t1", 1), ("t2", 2), ("t3", 3)):
+        principal_cache.add(token, _principal(user_id), jti=token)
+    assert set(principal_cache._keys_by_user) == {2, 3}
+    principal_cache.clear()
+    assert not principal_cache._keys_by_user
+
+
+def test_not_cached_past_the_token_expiry():
+    principal_cache = PrincipalCache(maxsize=10, ttl=60)
+    principal_cache.add("expired", _principal(1), jti=None, expires_at=time.time() - 1)
+    assert principal_cache.lookup("expired") is None
+
+
+def test_cached_requests_skip_the_database():
+    def queries(response) -> int:
+        return int(re.search(r'desc="(\d+) queries"', response.headers["server-timing"]).group(1))
+
+    async def scenario():
+        async with app_client() as client:
+            await create_user("user@example.com")
+            headers = await login(client, "user@example.com")
+            first = await client.get("/users/me", headers=headers)
+            second = await client.get("/users/me", headers=headers)
+            assert first.json() == second.json()
+            assert queries(first) > 0
+            assert queries(second) == 0
+
+    asyncio.run(scenario())
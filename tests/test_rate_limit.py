@@ -0,0 +1,113 @@
+"""Both rate limit backends enforce the same limits, the login route answers 429 once an account is throttled."""
+import asyncio
+
+import pytest
+
+from app.services import rate_limit
+from app.services.rate_limit import MemoryBackend, RedisBackend
+from tests.app_client import app_client, create_user
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class FakeRedis:
+    """The part of an asyncio redis client RedisBackend uses, with expiring keys."""
+
+    def __init__(self, clock: Clock):
+        self.clock = clock
+        self.values = {}
+        self.expires = {}
+
+    def _expire_keys(self):
+        for key, at in list(self.expires.items()):
+            if at <= self.clock.time():
+                del self.values[key], self.expires[key]
+
+    async def incr(self, key: str) -> int:
+        self._expire_keys()
+        self.values[key] = self.values.get(key, 0) + 1
+        return self.values[key]
+
+    async def expire(self, key: str, seconds: int):
+        self.expires[key] = self.clock.time() + seconds
+
+    async def get(self, key: str):
+        self._expire_keys()
+        value = self.values.get(key)
+        return None if value is None else str(value).encode()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request, clock):
+    if request.param == "memory":
+        return MemoryBackend()
+    return RedisBackend(FakeRedis(clock))
+
+
+def _hits(backend, key: str, count: int, limit: int = 5, window: float = 60):
+    async def hit():
+        return [await backend.hit(key, limit, window) for _ in range(count)]
+
+    return asyncio.run(hit())
+
+
+def test_limit_per_key(backend):
+    assert _hits(backend, "login:email:a", 5) == [0] * 5
+    retry_after = _hits(backend, "login:email:a", 1)[0]
+    assert 0 < retry_after <= 60
+    # other keys have their own budget
+    assert _hits(backend, "login:email:b", 5) == [0] * 5
+
+
+def test_budget_comes_back(backend, clock):
+    assert _hits(backend, "login:email:a", 6)[-1] > 0
+    clock.now += 120
+    assert _hits(backend, "login:email:a", 5) == [0] * 5
+
+
+def test_pruning_keeps_stricter_scopes(clock):
+    backend = MemoryBackend(max_keys=2)
+    assert _hits(backend, "forgot_password:email:a", 2, limit=1, window=3600)[-1] > 0
+    _hits(backend, "busy:ip:a", 1, limit=100, window=1)
+    clock.now += 2
+    # a new key with the dict full: busy:ip:a refilled and goes, the throttled account stays
+    _hits(backend, "busy:ip:b", 1, limit=100, window=1)
+    assert _hits(backend, "forgot_password:email:a", 1, limit=1, window=3600)[0] > 0
+
+
+def test_login_throttled_per_account():
+    async def scenario():
+        async with app_client() as client:
+            await create_user("target@example.com")
+            statuses = []
+            for _ in range(6):
+                response = await client.post("/auth/token", data={"username": "target@example.com",
+                                                                   "password": "wrong"},
+                                             headers={"Origin": "http://localhost:3000"})
+                statuses.append(response.status_code)
+            assert statuses == [401] * 5 + [429]
+            assert int(response.headers["retry-after"]) > 0
+            assert "access-control-allow-origin" in response.headers
+            # the limit is per account, the others can still log in
+            await create_user("other@example.com")
+            response = await client.post("/auth/token", data={"username": "other@example.com",
+                                                               "password": "password"})
+            assert response.status_code == 200
+
+    asyncio.run(scenario())
@@ -0,0 +1,47 @@
+"""Registration inserts the user and its role in one transaction, together with queueing the confirmation."""
+import asyncio
+
+from sqlalchemy import func, select
+
+from app.services.mailer import Mailer
+from app.sql_app import models
+from app.sql_app.database import SessionLocal
+from tests.app_client import app_client
+
+
+async def _count_users() -> int:
+    async with SessionLocal() as db:
+        return (await db.execute(select(func.count()).select_from(models.User))).scalar()
+
+
+def test_register(monkeypatch):
+    sent = []
+    monkeypatch.setattr(Mailer, "send_message", staticmethod(lambda content, subject, mail_to: sent.append(mail_to)))
+
+    async def scenario():
+        async with app_client() as client:
+            response = await client.post("/users/", json={"email": "new@example.com", "password": "password"})
+            assert response.status_code == 200, response.text
+            assert response.json()["roles"] == ["user"]
+            assert sent == ["new@example.com"]
+            response = await client.post("/users/", json={"email": "new@example.com", "password": "other"})
+            assert response.status_code == 400
+            assert response.json()["detail"] == "Email already registered"
+            assert await _count_users() == 1
+
+    asyncio.run(scenario())
+
+
+def test_no_user_left_without_its_confirmation(monkeypatch):
+    def full(content, subject, mail_to):
+        raise asyncio.QueueFull
+
+    monkeypatch.setattr(Mailer, "send_message", staticmethod(full))
+
+    async def scenario():
+        async with app_client() as client:
+            response = await client.post("/users/", json={"email": "new@example.com", "password": "password"})
+            assert response.status_code == 500
+            assert await _count_users() == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,97 @@
+"""Read-only sessions read from a healthy replica, writes and requests that wrote read from the primary."""
+import asyncio
+import shutil
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select, update
+
+from app.sql_app import database, models
+from app.sql_app.database import (Base, ReadSessionLocal, SessionLocal, dispose_db, init_db, may_read_stale,
+                                  read_user_from_primary)
+from tests.app_client import reset_singletons
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    """A primary and a replica that stopped replicating: the primary has the user's new email, it the old one."""
+    primary_path, replica_path = tmp_path / "primary.db", tmp_path / "replica.db"
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URL", f"sqlite:///{primary_path}")
+    monkeypatch.setenv("SQLALCHEMY_REPLICA_URLS", f'["sqlite:///{replica_path}"]')
+    monkeypatch.setenv("DB_REPLICA_CHECK_TIMEOUT", "0.1")
+    reset_singletons()
+
+    async def setup():
+        async with init_db().begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(models.User.__table__.insert().values(
+                id=1, email="old@example.com", hashed_password="x", is_active=True))
+        await dispose_db()
+        shutil.copy(primary_path, replica_path)
+        async with init_db().begin() as conn:
+            await conn.execute(update(models.User).values(email="new@example.com"))
+
+    asyncio.run(setup())
+    yield
+    asyncio.run(dispose_db())
+    database._primary_reads_until.clear()
+    reset_singletons()
+
+
+async def _email(session_factory=ReadSessionLocal, **kwargs) -> str:
+    async with session_factory(**kwargs) as db:
+        return (await db.execute(select(models.User.email).filter(models.User.id == 1))).scalar()
+
+
+def test_routing(replica):
+    async def scenario():
+        init_db()
+        await database.replicas.check()
+        assert await _email() == "old@example.com"
+        assert await _email(SessionLocal) == "new@example.com"
+
+        # once a request committed, it reads its own writes
+        request_state = SimpleNamespace()
+        assert await _email(info={"request_state": request_state}) == "old@example.com"
+        async with SessionLocal(info={"request_state": request_state}) as db:
+            await db.commit()
+        assert await _email(info={"request_state": request_state}) == "new@example.com"
+
+    asyncio.run(scenario())
+
+
+def test_read_user_from_primary(replica):
+    async def scenario():
+        init_db()
+        await database.replicas.check()
+        read_user_from_primary(1)
+        async with ReadSessionLocal() as db:
+            assert may_read_stale(db, 1) and not may_read_stale(db, 2)
+        async with SessionLocal() as db:
+            assert not may_read_stale(db, 1)
+        database._primary_reads_until[1] = 0
+        async with ReadSessionLocal() as db:
+            assert not may_read_stale(db, 1)
+
+    asyncio.run(scenario())
+
+
+def test_unhealthy_replica_is_skipped(replica):
+    async def hang(index):
+        await asyncio.sleep(10)
+
+    async def scenario():
+        init_db()
+        replicas = database.replicas
+        replicas._ping = hang
+        # unreachable replicas don't hold up the check longer than its timeout
+        await asyncio.wait_for(replicas.check(), timeout=1)
+        assert replicas.choose() is None
+        assert await _email() == "new@example.com"
+
+        del replicas._ping
+        await replicas.check()
+        assert replicas.choose() is replicas.engines[0]
+        assert await _email() == "old@example.com"
+
+    asyncio.run(scenario())
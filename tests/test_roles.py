@@ -0,0 +1,38 @@
+"""Role assignment and the role checks that read the cached roles."""
+import asyncio
+
+from tests.app_client import app_client, create_user, login
+
+
+def test_assign_role():
+    async def scenario():
+        async with app_client() as client:
+            await create_user("admin@example.com", roles=["admin"])
+            user_id = await create_user("user@example.com")
+            admin = await login(client, "admin@example.com")
+            user = await login(client, "user@example.com")
+            # caches the user's principal and roles
+            assert (await client.get("/users/me", headers=user)).json()["roles"] == ["user"]
+            assert (await client.get("/users/", headers=user)).status_code == 403
+
+            response = await client.post("/roles/", headers=admin, json={"owner_id": user_id, "role": "admin"})
+            assert response.status_code == 200, response.text
+            # the same token sees the new role right away
+            assert sorted((await client.get("/users/me", headers=user)).json()["roles"]) == ["admin", "user"]
+            assert (await client.get("/users/", headers=user)).status_code == 200
+
+            response = await client.post("/roles/", headers=admin, json={"owner_id": user_id, "role": "admin"})
+            assert response.status_code == 400
+
+    asyncio.run(scenario())
+
+
+def test_role_for_unknown_user():
+    async def scenario():
+        async with app_client() as client:
+            await create_user("admin@example.com", roles=["admin"])
+            admin = await login(client, "admin@example.com")
+            response = await client.post("/roles/", headers=admin, json={"owner_id": 999, "role": "editor"})
+            assert response.status_code == 400
+
+    asyncio.run(scenario())
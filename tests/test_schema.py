@@ -0,0 +1,39 @@
+"""The migrations build the schema of the models, and the read queries are served by its indexes."""
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine
+
+from app.sql_app.database import Base
+from benchmarks import query_plans
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_migrations_match_the_models(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'migrations.db'}"
+    # read by alembic_env.py
+    monkeypatch.setenv("SQLALCHEMY_DATABASE_URL", url)
+    config = Config(str(ROOT / "alembic.ini"))
+    config.set_main_option("script_location", str(ROOT / "db-migration"))
+    engine = create_engine(url)
+
+    command.upgrade(config, "head")
+    with engine.connect() as conn:
+        assert compare_metadata(MigrationContext.configure(conn), Base.metadata) == []
+    # and back, every revision can be rolled back
+    command.downgrade(config, "base")
+    with engine.connect() as conn:
+        assert set(engine.dialect.get_table_names(conn)) == {"alembic_version"}
+    engine.dispose()
+
+
+def test_query_plans_use_the_indexes():
+    # seeds the throwaway test database of conftest.py
+    failures = asyncio.run(query_plans.run(SimpleNamespace(users=2000, no_seed=False)))
+    assert failures == []
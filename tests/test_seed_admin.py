@@ -0,0 +1,47 @@
+"""The admin is seeded by a one-shot command, not by every worker's startup."""
+import asyncio
+
+from sqlalchemy import func, select
+
+from app import cli
+from app.sql_app import models
+from app.sql_app.database import SessionLocal, dispose_db
+from tests.app_client import app_client, login
+
+
+async def _count_users() -> int:
+    async with SessionLocal() as db:
+        return (await db.execute(select(func.count()).select_from(models.User))).scalar()
+
+
+async def _no_dispose():
+    pass
+
+
+def test_startup_creates_no_user():
+    async def scenario():
+        async with app_client():
+            return await _count_users()
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_seed_admin_once(monkeypatch, capsys):
+    monkeypatch.setenv("ADMIN_EMAIL", "boss@example.com")
+    monkeypatch.setenv("ADMIN_PASSWORD", "password")
+    # the app under test keeps using the engine
+    monkeypatch.setattr(cli, "dispose_db", _no_dispose)
+
+    async def scenario():
+        async with app_client() as client:
+            assert await cli.seed_admin("boss@example.com", "password")
+            assert not await cli.seed_admin("boss@example.com", "other")
+            headers = await login(client, "boss@example.com")
+            assert (await client.get("/users/me", headers=headers)).json()["roles"] == ["admin"]
+            assert await _count_users() == 1
+
+    asyncio.run(scenario())
+    # as run on a deploy, it opens and closes its own engine
+    monkeypatch.setattr(cli, "dispose_db", dispose_db)
+    cli.main(["seed-admin"])
+    assert capsys.readouterr().out == "Admin boss@example.com already exists\n"
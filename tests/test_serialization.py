@@ -0,0 +1,36 @@
+"""The orjson fast path encodes users exactly like the validated schemas.User would."""
+import json
+import uuid
+from types import SimpleNamespace
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+from app.main import app
+from app.services.user_utils import build_user_response, serialize_user
+from app.sql_app import schemas
+
+
+def _user(confirmation=None):
+    return SimpleNamespace(id=7, email="user7@example.com", is_active=False, confirmation=confirmation,
+                           roles=[SimpleNamespace(role="user"), SimpleNamespace(role="editor")])
+
+
+def test_same_json_as_the_schema():
+    for user in (_user(), _user(confirmation=uuid.uuid4())):
+        validated = jsonable_encoder(schemas.User(email=user.email, id=user.id, is_active=user.is_active,
+                                                  confirmation=user.confirmation,
+                                                  roles=[role.role for role in user.roles]))
+        assert orjson.loads(orjson.dumps(serialize_user(user))) == json.loads(json.dumps(validated))
+
+
+def test_roles_and_confirmation():
+    user = _user(confirmation=uuid.uuid4())
+    assert serialize_user(user, include_confirmation=False)["confirmation"] is None
+    assert serialize_user(user, role_names={"b", "a"})["roles"] == ["a", "b"]
+    principal = build_user_response(user, role_names=["user"])
+    assert isinstance(principal, schemas.User) and principal.roles == ["user"]
+
+
+def test_orjson_is_the_default_response_class():
+    assert app.router.default_response_class.__name__ == "ORJSONResponse"
@@ -0,0 +1,73 @@
+"""The production launcher: worker count, uvicorn options and the graceful shutdown timeout."""
+import asyncio
+from types import SimpleNamespace
+
+import uvicorn
+
+from app import server
+
+
+def test_default_workers(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "3")
+    assert server.default_workers() == 3
+    monkeypatch.delenv("WEB_CONCURRENCY")
+    monkeypatch.setattr(server.os, "sched_getaffinity", lambda pid: {0, 2}, raising=False)
+    assert server.default_workers() == 2
+
+
+def test_main_configures_uvicorn(monkeypatch):
+    started = []
+    monkeypatch.setattr(server.Server, "run", lambda self, sockets=None: started.append(self))
+    monkeypatch.setattr(server.Supervisor, "run", lambda self: started.append(self))
+
+    server.main(["--workers", "1", "--port", "8001", "--keep-alive", "75", "--max-requests", "1000",
+                 "--graceful-timeout", "5"])
+    (single,) = started
+    assert isinstance(single, server.Server) and single.graceful_timeout == 5
+    config = single.config
+    assert (config.loop, config.http, config.port) == ("uvloop", "httptools", 8001)
+    assert (config.timeout_keep_alive, config.limit_max_requests, config.limit_concurrency) == (75, 1000, 1000)
+
+    monkeypatch.setattr(uvicorn.Config, "bind_socket", lambda self: "socket")
+    server.main(["--workers", "2"])
+    supervisor = started[-1]
+    assert isinstance(supervisor, server.Supervisor) and supervisor.sockets == ["socket"]
+
+
+class StuckConnection:
+    """Never finishes its response on its own, like a slow client."""
+
+    def __init__(self, server_state):
+        self.server_state = server_state
+        self.transport = self
+
+    def shutdown(self):
+        pass
+
+    def close(self):
+        self.server_state.connections.discard(self)
+
+
+def test_shutdown_aborts_stuck_requests():
+    async def scenario():
+        instance = server.Server(uvicorn.Config("app.main:app"), graceful_timeout=0.2)
+        instance.servers = []
+        shutdown_hooks = []
+
+        async def lifespan_shutdown():
+            shutdown_hooks.append(True)
+
+        instance.lifespan = SimpleNamespace(shutdown=lifespan_shutdown)
+        state = instance.server_state
+        state.connections.add(StuckConnection(state))
+        task = asyncio.get_running_loop().create_task(asyncio.sleep(10))
+        task.add_done_callback(state.tasks.discard)
+        state.tasks.add(task)
+        # uvicorn alone would wait for both forever
+        await asyncio.wait_for(instance.shutdown(), timeout=5)
+        return task, state, shutdown_hooks
+
+    task, state, shutdown_hooks = asyncio.run(scenario())
+    assert task.cancelled() and not state.connections
+    # the app's shutdown hooks still ran
+    assert shutdown_hooks == [True]
@@ -0,0 +1,85 @@
+"""Logout revokes the access token, in this worker right away and in the others after a sync."""
+import asyncio
+from datetime import datetime, timedelta
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from app.services.tokens import BloomFilter, RevocationList, TokenError, TokenService
+from app.sql_app import crud
+from app.sql_app.database import SessionLocal
+from tests.app_client import app_client, create_user, login
+
+
+@pytest.mark.parametrize("bloom", ["false", "true"])
+def test_logout_revokes_the_token(monkeypatch, bloom):
+    monkeypatch.setenv("TOKEN_REVOCATION_BLOOM_FILTER", bloom)
+
+    async def scenario():
+        async with app_client() as client:
+            await create_user("user@example.com")
+            headers = await login(client, "user@example.com")
+            other = await login(client, "user@example.com")
+            # the principal is cached, logout has to drop it too
+            assert (await client.get("/users/me", headers=headers)).status_code == 200
+            assert (await client.post("/auth/logout", headers=headers)).status_code == 200
+            assert (await client.get("/users/me", headers=headers)).status_code == 401
+            assert (await client.post("/auth/logout", headers=headers)).status_code == 401
+            assert (await client.get("/users/me", headers=other)).status_code == 200
+
+            # another worker learns about it from the database
+            jti = jwt.decode(headers["Authorization"].split()[1], options={"verify_signature": False})["jti"]
+            worker = RevocationList(sync_interval=30, use_bloom=bloom == "true")
+            await worker.sync()
+            async with SessionLocal() as db:
+                assert await worker.is_revoked(db, jti)
+                assert not await worker.is_revoked(db, "not-revoked")
+
+    asyncio.run(scenario())
+
+
+def test_prune_deletes_expired_tokens_only():
+    async def scenario():
+        async with app_client():
+            now = datetime.utcnow()
+            async with SessionLocal() as db:
+                await crud.revoke_token(db, jti="expired", expires_at=now - timedelta(minutes=1))
+                await crud.revoke_token(db, jti="valid", expires_at=now + timedelta(minutes=10))
+            await RevocationList(sync_interval=30).prune()
+            async with SessionLocal() as db:
+                return await crud.get_revoked_jtis(db, now=now - timedelta(hours=1))
+
+    assert asyncio.run(scenario()) == ["valid"]
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000)
+    for i in range(1000):
+        bloom.add(f"jti-{i}")
+    assert all(f"jti-{i}" in bloom for i in range(1000))
+    # 0.1% expected, some margin
+    assert sum(f"other-{i}" in bloom for i in range(10000)) < 50
+
+
+def test_rs256_tokens():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                            serialization.NoEncryption())
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+    signer = TokenService("RS256", private_key_pem=private_pem)
+    verifier = TokenService("RS256", public_key_pem=public_pem)
+    token = signer.encode({"sub": "user@example.com", "exp": datetime.utcnow() + timedelta(minutes=5)})
+    assert verifier.decode(token)["sub"] == "user@example.com"
+    assert verifier.jwks()["keys"][0]["kty"] == "RSA"
+    with pytest.raises(TokenError):
+        verifier.encode({"sub": "user@example.com"})
+
+    expired = signer.encode({"sub": "user@example.com", "exp": datetime.utcnow() - timedelta(minutes=1)})
+    with pytest.raises(TokenError, match="expired"):
+        verifier.decode(expired)
+    # a token signed with the shared secret isn't accepted in place of the key
+    with pytest.raises(TokenError):
+        verifier.decode(TokenService("HS256", secret_key="test-secret").encode({"sub": "user@example.com"}))